@@ -1,42 +1,120 @@
 import os
-import json
+import sys
+import copy
+import glob
+import time
 import random
+import argparse
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import wget
 from PIL import Image
-import requests
 import numpy as np
-import cv2
-from sklearn.cluster import KMeans
-from scipy.stats import mode
-import matplotlib.pyplot as plt
 
-# pygame is great but I need clean logs
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide" 
-import pygame
-
-from helpers.BorderBuilder import BorderBuilder
+from helpers.BorderBuilder import BorderBuilder, EDGE_ENGINES, CAFFEMODEL, parse_hed_scale
+from helpers.NetRegistry import BACKENDS, TARGETS
 from helpers.LineBuilder import LineBuilder
 from helpers.ColorBuilder import ColorBuilder
 from helpers.Painting import Painting
+from helpers.StageCache import StageCache
+from helpers.ArtifactWriter import ArtifactWriter, LEVELS
+from helpers.images import open_image, fit_size, blend
 
 class MondrianPipeline:
     """The full input to output pipeline for transforming an image into a 
     Mondrian painting
+
+    With `in_memory=True` the stages hand arrays and builders to each other
+    directly instead of re-reading each other's files, and `image_in` may be an
+    RGB NumPy array. Files are then written in the background by an
+    ArtifactWriter, passed as `artifacts`, whose level picks which files are
+    written at all. By default only the painting and overlay are written to
+    `output_dir`, or everything including the structure histogram if
+    `save_intermediates` is set. On disk every file is written, and only the
+    ones a later stage reads back (the resized and threshold images) are
+    written before moving on; the rest go through a writer of the pipeline's
+    own. Call `flush` to wait for the files, and `close` (or use the pipeline
+    as a context manager) to also stop the writer's threads.
+
+    With `SIZE=None` the image keeps its original size; set `hed_tile_size` so
+    that edge detection on large images runs in tiles with bounded memory.
+    When shrinking a JPEG, `resize` has the decoder scale it down while
+    decoding so that a large photo is never fully decoded; pass
+    `reduced_decode=False` to decode at full size first.
+
+    The structure is always found at `SIZE`, but the painting and overlay can
+    be rendered at `render_size`: a maximum width or height like `SIZE`, or
+    'original' for the size of the input image.
+
+    `edge_engine` picks BorderBuilder's edge detector: 'hed' (the default),
+    or 'canny' or 'sobel' for a much faster classical detector that needs no
+    model, e.g. for previews and bulk jobs. HED runs at `hed_scale` times the
+    resized image's size, or with `hed_scale='auto'` at whatever scale should
+    fit its pass into `latency_budget` seconds (see BorderBuilder).
+
+    Pass a StageCache as `cache` to reuse the HED map, segments and color point
+    of an image that has been through the pipeline with the same parameters.
+    An edge engine object needs a `cache_key` string that describes its
+    settings for its HED map and segments to be cached.
+
+    Every callable in `hooks` (e.g. a MetricsRecorder) is called with a record
+    of each stage's wall time, CPU time, memory use and counters. Peak memory
+    is only measured with `trace_memory=True`, since tracemalloc slows the
+    stages down. Without hooks the stages run untimed.
     """
     def __init__(self, 
         image_in,
         random=False,
         output_dir='output/',
         hed_threshold=190,
-        SIZE=500
+        SIZE=500,
+        in_memory=False,
+        save_intermediates=False,
+        hed_tile_size=None,
+        k_range=(2, 7),
+        min_percent_split=.1,
+        cache=None,
+        hooks=None,
+        trace_memory=False,
+        reduced_decode=True,
+        artifacts=None,
+        render_size=None,
+        edge_engine='hed',
+        hed_scale=1.0,
+        latency_budget=None
     ):
         self.image_in = image_in
+        self.source = image_in
         self.output_dir = output_dir
         self.hed_threshold = hed_threshold
         self.SIZE = SIZE
-
-        if not os.path.isdir(output_dir):
+        self.in_memory = in_memory
+        self.save_intermediates = save_intermediates
+        self.hed_tile_size = hed_tile_size
+        self.k_range = k_range
+        self.min_percent_split = min_percent_split
+        self.cache = cache
+        self.hooks = hooks or []
+        self.trace_memory = trace_memory
+        self.reduced_decode = reduced_decode
+        self.render_size = render_size
+
+        if isinstance(edge_engine, str) and edge_engine not in EDGE_ENGINES:
+            raise ValueError(f'edge_engine must be one of {", ".join(EDGE_ENGINES)}')
+        self.edge_engine = edge_engine
+        self.hed_scale = hed_scale
+        self.latency_budget = latency_budget
+        self.name = image_in if isinstance(image_in, str) else None
+
+        # on disk, every file is written and the stages read some of them back,
+        #   so the level can only be picked in memory
+        if artifacts is not None and not in_memory:
+            raise ValueError('artifacts can only be passed with in_memory=True')
+        if artifacts is None:
+            artifacts = ArtifactWriter('debug' if save_intermediates or not in_memory else 'final')
+        self.artifacts = artifacts
+
+        if self._writes_files() and not os.path.isdir(output_dir):
             os.mkdir(output_dir)
 
         if random:
@@ -45,18 +123,172 @@ class MondrianPipeline:
         self.step = 0
 
         # Vars to be set later
+        self.original_size = None
+        self.resized_file = None
+        self.pixel_hash = None
+        self.cached_segments = None
+        self.resized = None
+        self.border_builder = None
         self.line_builder = None
         self.color_builder = None
         self.painting = None
+        self.overlay = None
 
-    def _step_files_forward(self, function):
+    def _step_files_forward(self, function, extension='jpg'):
         """Step the pipeline forward and name the new file after the current function"""
         old_file = self.image_in
-        new_file = os.path.join(self.output_dir, f'{self.step}-{function}.jpg')
+        new_file = os.path.join(self.output_dir, f'{self.step}-{function}.{extension}')
         self.image_in = new_file
         self.step += 1
         return old_file, new_file
 
+    def _writes_files(self):
+        return self.artifacts.wants('final')
+
+    def _write(self, level, save, filename, read_back=False):
+        """Save a file now if a later stage reads it back from disk, otherwise 
+        hand it to the artifact writer, which writes it later if its level is 
+        wanted
+        """
+        if read_back and not self.in_memory:
+            save(filename)
+        else:
+            self.artifacts.submit(level, save, self.artifacts.path(filename, level))
+
+    def flush(self):
+        """Wait until the artifact writer has written every file so far"""
+        self.artifacts.flush()
+
+    def close(self):
+        """Wait for the files, then stop the artifact writer's threads"""
+        self.artifacts.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _max_rss():
+        """The process's peak resident memory in bytes, or None on Windows"""
+        try:
+            import resource
+        except ImportError:
+            return None
+        # macOS reports ru_maxrss in bytes, Linux in kilobytes
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _run_stage(self, stage, function):
+        """Run a stage, reporting its metrics to the hooks if there are any"""
+        return MondrianPipeline._run_shared_stage([self], stage, function)
+
+    @staticmethod
+    def _run_shared_stage(pipelines, stage, function, **counters):
+        """Run a stage once for several pipelines at a time, reporting the 
+        metrics of the whole run to each pipeline's hooks, along with 
+        `counters`
+        """
+        hooked = [mp for mp in pipelines if mp.hooks]
+        if not hooked:
+            return function()
+
+        tracing = any(mp.trace_memory for mp in hooked)
+        if tracing:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            else:
+                # before Python 3.9 the peak can only be reset along with the traces
+                tracemalloc.clear_traces()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = function()
+        wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+        peak_memory = None
+        if tracing:
+            peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+            if started_tracing:
+                tracemalloc.stop()
+
+        max_rss = MondrianPipeline._max_rss()
+        for mp in hooked:
+            record = {
+                'stage': stage,
+                'image': mp.name,
+                'wall_time': wall_time,
+                'cpu_time': cpu_time,
+                'peak_memory': peak_memory if mp.trace_memory else None,
+                'max_rss': max_rss,
+                'counters': {**mp._stage_counters(stage), **counters}
+            }
+            for hook in mp.hooks:
+                hook(record)
+        return result
+
+    def _stage_counters(self, stage):
+        """Counters that describe the work a stage did"""
+        counters = {}
+        if stage == 'resize' and self.resized is not None:
+            counters['height'], counters['width'] = self.resized.shape[:2]
+        elif stage == 'find_borders':
+            counters['cached'] = self.cached_segments is not None
+        elif stage == 'find_structure':
+            line_builder = self.line_builder
+            counters['segments'] = len(line_builder.segments['x']) + len(line_builder.segments['y'])
+            counters['faces'] = len(line_builder.face_index.faces)
+            if line_builder.raw_segments is not None:
+                counters['edge_pixels'] = len(line_builder.edges)
+                counters['raw_segments'] = len(line_builder.raw_segments)
+                if line_builder.kmeansx is not None:
+                    counters['k_x'] = line_builder.kmeansx.n_clusters
+                    counters['k_y'] = line_builder.kmeansy.n_clusters
+        return {name: int(value) for name, value in counters.items()}
+
+    def _edge_engine_key(self):
+        """A name for the edge engine that's the same from run to run, or None
+        if it doesn't have one
+        """
+        if isinstance(self.edge_engine, str):
+            return self.edge_engine
+        return getattr(self.edge_engine, 'cache_key', None)
+
+    def _cache_key(self, stage):
+        """Key a stage's output on the resized pixels and the parameters it uses.
+        Returns None if the output can't be cached.
+        """
+        params = {'SIZE': self.SIZE}
+        if stage in ('hed', 'segments'):
+            params['edge_engine'] = self._edge_engine_key()
+            if params['edge_engine'] is None:
+                return None
+            params['hed_tile_size'] = self.hed_tile_size
+            params['hed_scale'] = self.hed_scale
+            params['latency_budget'] = self.latency_budget
+        if stage == 'segments':
+            params['hed_threshold'] = self.hed_threshold
+            params['k_range'] = list(self.k_range)
+            params['min_percent_split'] = self.min_percent_split
+        return StageCache.key(stage, self.pixel_hash, **params)
+
+    def _cache_get(self, stage):
+        """Return a stage's cached output, or None if it isn't cached"""
+        key = self._cache_key(stage) if self.cache is not None else None
+        if key is None:
+            return None
+        return self.cache.get(key)
+
+    def _cache_put(self, stage, value):
+        """Cache a stage's output if the pipeline has a cache"""
+        key = self._cache_key(stage) if self.cache is not None else None
+        if key is not None:
+            self.cache.put(key, value)
+
 
     def resize(self):
         """Proportionally resize the input image so that the max height or 
@@ -64,49 +296,139 @@ class MondrianPipeline:
         """
         old_file, new_file = self._step_files_forward('resize')
 
-        im = Image.open(old_file)
+        im = open_image(old_file)
+        self.original_size = im.size
 
-        width, height = im.width, im.height
-        if width > height:
-            new_width = self.SIZE
-            new_height = int(new_width / width * height)
-        else:
-            new_height = self.SIZE
-            new_width = int(new_height / height * width)
-
-        im = im.resize((new_width, new_height))
-        im.save(new_file)
+        if self.SIZE is not None:
+            size = fit_size(im.width, im.height, self.SIZE)
+            if self.reduced_decode:
+                # let the JPEG decoder scale down by up to 8x while it decodes, 
+                #   the resize below then only has to cover the rest
+                im.draft(None, size)
+            im = im.resize(size)
+        if self.in_memory:
+            self.resized = np.asarray(im.convert('RGB'))
+        if self.cache is not None:
+            self.pixel_hash = StageCache.hash_pixels(np.asarray(im))
+        self._write('all', im.save, new_file, read_back=True)
+        self.resized_file = new_file
 
 
     def find_primary_colors(self):
         """Make a ColorBuilder"""
-        color_builder = ColorBuilder(self.image_in)
-        color_builder.get_color_point()
+        color_builder = ColorBuilder(self.resized if self.in_memory else self.image_in)
+
+        cached = self._cache_get('color')
+        if cached is None:
+            color_builder.get_color_point()
+            self._cache_put('color', {
+                'coordinate': list(color_builder.primary_color_coordinate),
+                'color': color_builder.primary_color
+            })
+        else:
+            color_builder.primary_color_coordinate = list(cached['coordinate'])
+            color_builder.primary_color = cached['color']
+
         self.color_builder = color_builder
 
     
     def find_borders(self):
         """Make a BorderBuilder and save the images"""
-        old_file, new_file = self._step_files_forward('apply-hed')
+        border_builder, hed_file = self._start_borders()
+        if self._borders_from_cache(border_builder, hed_file):
+            return
 
-        border_builder = BorderBuilder(old_file)
         border_builder.apply_hed()
-        border_builder.save_hed(new_file)
+        self._cache_put('hed', border_builder.hed)
+        self._finish_borders(border_builder, hed_file)
+
+
+    def _borders_from_cache(self, border_builder, hed_file):
+        """Finish `find_borders` from the cache if it can be. Returns False if
+        HED still needs to run.
+        """
+        # If the structure is cached there's nothing for HED to do
+        self.cached_segments = self._cache_get('segments')
+        if self.cached_segments is not None:
+            self._step_files_forward('apply-hed-threshold', 'png')
+            return True
+
+        hed = self._cache_get('hed')
+        if hed is None:
+            return False
+        border_builder.hed = hed
+        self._finish_borders(border_builder, hed_file)
+        return True
+
+
+    def _start_borders(self):
+        """Make a BorderBuilder for the resized image"""
+        old_file, new_file = self._step_files_forward('apply-hed')
+
+        border_builder = BorderBuilder(
+            self.resized if self.in_memory else old_file,
+            hed_threshold=self.hed_threshold,
+            tile_size=self.hed_tile_size,
+            engine=self.edge_engine,
+            hed_scale=self.hed_scale,
+            latency_budget=self.latency_budget
+        )
+        return border_builder, new_file
 
 
-        old_file, new_file = self._step_files_forward('apply-hed-threshold')
+    def _finish_borders(self, border_builder, hed_file):
+        """Save the HED image, then apply and save the threshold"""
+        self._write('all', border_builder.save_hed, hed_file)
+
+
+        # find_structure reads the threshold back from disk, so keep it lossless
+        old_file, new_file = self._step_files_forward('apply-hed-threshold', 'png')
         
         border_builder.apply_hed_threshold()
-        border_builder.save_threshold(new_file)
+        self._write('all', border_builder.save_threshold, new_file, read_back=True)
+
+        self.border_builder = border_builder
+
+
+    @staticmethod
+    def find_borders_batch(pipelines, **kwargs):
+        """`find_borders` for several pipelines at once, sharing HED forward 
+        passes. Keyword arguments are passed to `BorderBuilder.apply_hed_batch`.
+        Pipelines with a cache only send the images it misses through HED.
+        """
+        started = []
+        for mp in pipelines:
+            border_builder, hed_file = mp._start_borders()
+            if not mp._borders_from_cache(border_builder, hed_file):
+                started.append((mp, border_builder, hed_file))
+
+        BorderBuilder.apply_hed_batch([border_builder for _, border_builder, _ in started], **kwargs)
+        for mp, border_builder, hed_file in started:
+            mp._cache_put('hed', border_builder.hed)
+            mp._finish_borders(border_builder, hed_file)
 
 
     def find_structure(self):
         """Make a LineBuilder and save the image"""
         old_file, new_file = self._step_files_forward('find-structure')
 
-        line_builder = LineBuilder(old_file)
-        line_builder.analyze_image()
-        line_builder.save(new_file)
+        if self.cached_segments is not None:
+            cached = self.cached_segments
+            line_builder = LineBuilder.from_segments(
+                cached['segments'], cached['width'], cached['height'], self.min_percent_split
+            )
+        else:
+            line_builder = LineBuilder(
+                self.border_builder.edges if self.in_memory else old_file,
+                self.min_percent_split
+            )
+            line_builder.analyze_image(self.k_range)
+            self._cache_put('segments', {
+                'segments': line_builder.segments,
+                'width': line_builder.width,
+                'height': line_builder.height
+            })
+            self._write('debug', line_builder.save, new_file)
 
         self.line_builder = line_builder
 
@@ -115,47 +437,156 @@ class MondrianPipeline:
         """Make a Painting and save the image"""
         old_file, new_file = self._step_files_forward('create-painting')
 
-        segments = self.line_builder.segments
-
-        painting = Painting(self.line_builder, self.color_builder)
+        painting = Painting(self.line_builder, self.color_builder, size=self._render_size())
         painting.create()
-        painting.save(new_file)
+        self._write('final', painting.save, new_file)
 
         self.painting = painting
 
 
+    def _render_size(self):
+        """The (width, height) to render the painting and overlay at"""
+        if self.render_size is None:
+            return self.line_builder.width, self.line_builder.height
+        if self.render_size == 'original':
+            return self.original_size
+        return fit_size(*self.original_size, self.render_size)
+
+
+    def _background(self, size):
+        """The input image at the given (width, height)"""
+        if size == (self.line_builder.width, self.line_builder.height):
+            if self.in_memory:
+                return self.resized
+            return np.asarray(Image.open(self.resized_file).convert('RGB'))
+
+        im = open_image(self.source)
+        if self.reduced_decode:
+            im.draft(None, size)
+        return np.asarray(im.convert('RGB').resize(size))
+
+
     def create_overlay(self):
-        """Convert to PNGs and overlay the input image on top of the painting"""
+        """Overlay the input image on top of the painting"""
         old_file, new_file = self._step_files_forward('create-overlay')
 
-        resize_im = [self.output_dir + x for x in os.listdir(self.output_dir) if 'resize' in x][0]
-        background = Image.open(resize_im)
-        overlay = Image.open(old_file)
+        painting = self.painting.to_array()
+        background = self._background((painting.shape[1], painting.shape[0]))
 
-        background = background.convert("RGBA")
-        overlay = overlay.convert("RGBA")
+        new_img = Image.fromarray(blend(background, painting))
+        self._write('final', new_img.save, new_file)
 
-        new_img = Image.blend(background, overlay, 0.5)
-        new_img = new_img.convert('RGB')
-        new_img.save(new_file)
+        self.overlay = new_img
 
 
 
     def apply_image_transform(self):
         """Usher the user through the pipeline"""
-        self.resize()
+        self._run_stage('resize', self.resize)
         
+        self._run_stage('find_primary_colors', self.find_primary_colors)
+        self._run_stage('find_borders', self.find_borders)
+        self._run_stage('find_structure', self.find_structure)
+
+        self._run_stage('create_painting', self.create_painting)
+
+        self._run_stage('create_overlay', self.create_overlay)
+
+
+    def sweep(
+        self,
+        hed_thresholds=(190,),
+        min_percent_splits=(.1,),
+        buffer_quantiles=(0.05,),
+        line_widths=(8,)
+    ):
+        """Build a layout and painting for every combination of the given 
+        parameters while running HED only once.
+
+        Work is shared wherever the parameters allow: one threshold image and
+        one set of kmeans models per `hed_threshold`, one layout (and color box)
+        per `min_percent_split` and `buffer_quantile`, and one painting per 
+        `line_width`. Returns a list of dicts holding each combination's 
+        parameters, `line_builder` and `painting`.
+        """
+        self.resize()
         self.find_primary_colors()
-        self.find_borders()
-        self.find_structure()
 
-        self.create_painting()
+        border_builder, _ = self._start_borders()
+        hed = self._cache_get('hed')
+        if hed is None:
+            border_builder.apply_hed()
+            self._cache_put('hed', border_builder.hed)
+        else:
+            border_builder.hed = hed
+        self.border_builder = border_builder
+
+        results = []
+        for hed_threshold in hed_thresholds:
+            border_builder.hed_threshold = hed_threshold
+            border_builder.apply_hed_threshold()
+
+            # the kmeans models only depend on the edge pixels
+            base_line_builder = LineBuilder(border_builder.edges)
+            base_line_builder.get_best_kmeans(self.k_range)
+
+            for min_percent_split in min_percent_splits:
+                for buffer_quantile in buffer_quantiles:
+                    line_builder = copy.copy(base_line_builder)
+                    line_builder.min_percent_split = min_percent_split
+                    line_builder.get_raw_segments(buffer_quantile)
+                    line_builder.clean_raw_segments()
+                    line_builder.build_face_index()
+
+                    # the color box depends on the layout, not the line width
+                    color_builder = copy.copy(self.color_builder)
+                    color_builder.primary_color_coordinate = list(self.color_builder.primary_color_coordinate)
+                    color_builder.primary_color_box = None
+
+                    for line_width in line_widths:
+                        painting = Painting(line_builder, color_builder, line_width=line_width)
+                        painting.create()
+
+                        results.append({
+                            'hed_threshold': hed_threshold,
+                            'min_percent_split': min_percent_split,
+                            'buffer_quantile': buffer_quantile,
+                            'line_width': line_width,
+                            'line_builder': line_builder,
+                            'painting': painting
+                        })
+
+        return results
+
+
+    @staticmethod
+    def apply_image_transform_batch(pipelines, **kwargs):
+        """Usher several pipelines through together so that their HED passes 
+        can be batched. Each pipeline's `find_borders` record has the time of 
+        the whole batch, and its size as the `batch_size` counter.
+        """
+        for mp in pipelines:
+            mp._run_stage('resize', mp.resize)
+            mp._run_stage('find_primary_colors', mp.find_primary_colors)
+
+        MondrianPipeline._run_shared_stage(
+            pipelines, 'find_borders',
+            lambda: MondrianPipeline.find_borders_batch(pipelines, **kwargs),
+            batch_size=len(pipelines)
+        )
 
-        self.create_overlay()
+        for mp in pipelines:
+            mp._run_stage('find_structure', mp.find_structure)
+            mp._run_stage('create_painting', mp.create_painting)
+            mp._run_stage('create_overlay', mp.create_overlay)
 
 
     def get_random_image(self):
         """Download random image of random dimensions from Unsplash"""
+        # only needed for random images, so they aren't imported up front
+        import requests
+        import wget
+
         if os.path.exists(self.image_in):
             os.remove(self.image_in)
 
@@ -170,12 +601,174 @@ class MondrianPipeline:
         print() # for cleaner shell logs
 
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def find_images(source):
+    """List the images in a directory, or the files matching a glob"""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _init_worker(options, dnn_threads, dnn_backend, dnn_target):
+    """Set up cv2 and load the HED network once per worker process, if it's 
+    used, and time it if the inference scale is picked automatically
+    """
+    BorderBuilder.configure_dnn(dnn_threads, dnn_backend, dnn_target)
+    if options['edge_engine'] == 'hed':
+        BorderBuilder.warm_up()
+        if options['hed_scale'] == 'auto':
+            BorderBuilder.calibrate()
+
+
+def _process_image(image_path, output_dir, artifact_level, options):
+    """Run one image through the pipeline and report how it went"""
+    start = time.perf_counter()
+    try:
+        with MondrianPipeline(
+            image_path, output_dir=output_dir, 
+            in_memory=True, artifacts=ArtifactWriter(artifact_level),
+            **options
+        ) as mp:
+            mp.apply_image_transform()
+    except Exception as e:
+        return image_path, time.perf_counter() - start, f'{type(e).__name__}: {e}'
+    return image_path, time.perf_counter() - start, None
+
+
+def run_batch(
+    source,
+    output_dir='output/',
+    processes=None,
+    save_intermediates=False,
+    artifact_level=None,
+    edge_engine='hed',
+    hed_scale=1.0,
+    latency_budget=None,
+    dnn_threads=None,
+    dnn_backend=None,
+    dnn_target=None,
+    cache=None
+):
+    """Push a directory or glob of images through a pool of worker processes.
+    Each image gets its own directory inside `output_dir`, named after the file.
+    `artifact_level` picks which files are written (see ArtifactWriter), and
+    defaults to `debug` with `save_intermediates` and `final` without.
+
+    Every worker gets `dnn_threads` cv2 threads, by default an even share of
+    the CPUs so that the workers don't fight over cores. `dnn_backend` and
+    `dnn_target` are passed to `BorderBuilder.configure_dnn`.
+
+    Pass a StageCache as `cache` to share one cache directory between the
+    workers, so images that come through again skip HED and the clustering.
+    """
+    if artifact_level is None:
+        artifact_level = 'debug' if save_intermediates else 'final'
+    if processes is None:
+        processes = os.cpu_count()
+    if dnn_threads is None:
+        dnn_threads = max(1, os.cpu_count() // processes)
+    options = {
+        'edge_engine': edge_engine, 'hed_scale': hed_scale, 'latency_budget': latency_budget,
+        'cache': cache
+    }
+
+    # every worker would fail to load HED, so fail before starting them
+    if edge_engine == 'hed' and not os.path.exists(CAFFEMODEL):
+        raise FileNotFoundError(f'HED needs {CAFFEMODEL}, or pick another edge_engine')
+
+    images = find_images(source)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # Name each image's output directory after its file, and keep the names 
+    #   unique if images from different directories share one
+    image_dirs = {}
+    for image_path in images:
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        image_dir, n = name, 1
+        while image_dir in image_dirs.values():
+            image_dir, n = f'{name}-{n}', n + 1
+        image_dirs[image_path] = image_dir
+
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(
+        options, dnn_threads, dnn_backend, dnn_target
+    )) as executor:
+        futures = {
+            executor.submit(
+                _process_image, image_path, 
+                os.path.join(output_dir, image_dirs[image_path]), artifact_level, options
+            ): image_path for image_path in images
+        }
+        for future in as_completed(futures):
+            try:
+                image_path, seconds, error = future.result()
+            except Exception as e:
+                # the worker itself died (or never started), e.g. BrokenProcessPool
+                image_path, error = futures[future], f'{type(e).__name__}: {e}'
+            if error is None:
+                print(f'{image_path}: {seconds:.2f}s')
+            else:
+                print(f'{image_path}: FAILED ({error})')
+                failures.append({'image': image_path, 'error': error})
+    seconds = time.perf_counter() - start
+
+    processed = len(images) - len(failures)
+    images_per_second = processed / seconds if seconds else 0.0
+    print(f'Processed {processed}/{len(images)} images in {seconds:.1f}s ({images_per_second:.2f} images/second)')
+
+    return {
+        'images': len(images),
+        'processed': processed,
+        'failures': failures,
+        'seconds': seconds,
+        'images_per_second': images_per_second
+    }
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Transform images into Mondrian paintings')
+    parser.add_argument('--batch', help='a directory or glob of images to process')
+    parser.add_argument('--output-dir', default='output/')
+    parser.add_argument('--processes', type=int, default=None, help='defaults to the number of CPUs')
+    parser.add_argument('--save-intermediates', action='store_true')
+    parser.add_argument('--artifacts', choices=LEVELS, help='which files to write, overrides --save-intermediates')
+    parser.add_argument('--edge-engine', choices=EDGE_ENGINES, default='hed', help='canny and sobel are fast and need no model')
+    parser.add_argument('--hed-scale', type=parse_hed_scale, default=1.0, help="run HED at this fraction of the size, or 'auto'")
+    parser.add_argument('--latency-budget', type=float, help="seconds for each HED pass with --hed-scale auto")
+    parser.add_argument('--dnn-threads', type=int, help='cv2 threads per process, defaults to a share of the CPUs')
+    parser.add_argument('--dnn-backend', choices=BACKENDS)
+    parser.add_argument('--dnn-target', choices=TARGETS)
+    parser.add_argument('--cache-dir', help='cache stage outputs here, and reuse them for repeated images')
+    args = parser.parse_args()
+
+    if args.hed_scale == 'auto' and args.latency_budget is None:
+        parser.error('--hed-scale auto needs a --latency-budget')
+
+    if args.batch:
+        run_batch(
+            args.batch, args.output_dir, args.processes, 
+            args.save_intermediates, args.artifacts, args.edge_engine,
+            args.hed_scale, args.latency_budget,
+            args.dnn_threads, args.dnn_backend, args.dnn_target,
+            StageCache(args.cache_dir) if args.cache_dir else None
+        )
+        return
+
     image = 'unsplash-random.jpg'
     # mp = MondrianPipeline(image)
     
-    mp = MondrianPipeline(image, random=True)
-    mp.apply_image_transform()
+    BorderBuilder.configure_dnn(args.dnn_threads, args.dnn_backend, args.dnn_target)
+    with MondrianPipeline(
+        image, random=True, output_dir=args.output_dir, edge_engine=args.edge_engine,
+        hed_scale=args.hed_scale, latency_budget=args.latency_budget
+    ) as mp:
+        mp.apply_image_transform()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,399 @@
+import io
+import json
+import time
+import base64
+import asyncio
+import argparse
+from collections import deque
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from MondrianPipeline import MondrianPipeline
+from helpers.BorderBuilder import BorderBuilder, EDGE_ENGINES, parse_hed_scale
+from helpers.NetRegistry import BACKENDS, TARGETS
+from helpers.ArtifactWriter import ArtifactWriter
+from helpers.StageCache import StageCache
+
+OUTPUTS = ('painting', 'overlay', 'both')
+
+
+class MondrianService:
+    """A small asyncio HTTP server that turns uploaded images into paintings.
+
+    POST the raw bytes of an image to `/paint` and get the painting back as a
+    PNG. Use `/paint?output=overlay` for the overlay, or `output=both` for a
+    JSON object with both PNGs base64 encoded. `GET /stats` reports the queue
+    depth and latency percentiles.
+
+    Uploads wait in a bounded queue, and the server answers 503 when it's full
+    rather than letting work pile up. Each of the `workers` takes whatever has
+    queued up, waiting up to `batch_wait` seconds for company, and runs that
+    batch in a thread so the HED passes are shared with
+    `BorderBuilder.apply_hed_batch`. Every worker gets a warm HED net at
+    startup, unless `edge_engine` swaps HED for 'canny' or 'sobel'.
+
+    `hed_scale` and `latency_budget` are passed on to BorderBuilder; with
+    batching the budget is per image, not per pass. `dnn_threads` sets cv2's
+    thread count, which the worker threads all share since it's per process;
+    by default cv2 uses every core. `dnn_backend` and `dnn_target` pick what
+    HED runs on.
+
+    With a StageCache as `cache`, repeated uploads skip HED and the
+    clustering, and only the images a batch misses share its HED pass.
+    """
+    def __init__(
+        self,
+        host='127.0.0.1',
+        port=8080,
+        workers=2,
+        queue_size=32,
+        max_batch_size=4,
+        batch_wait=0.01,
+        SIZE=500,
+        hed_threshold=190,
+        edge_engine='hed',
+        hed_scale=1.0,
+        latency_budget=None,
+        dnn_threads=None,
+        dnn_backend=None,
+        dnn_target=None,
+        cache=None,
+        max_upload_bytes=20 * 2 ** 20,
+        request_timeout=30,
+        latency_window=1000
+    ):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self.SIZE = SIZE
+        self.hed_threshold = hed_threshold
+        self.edge_engine = edge_engine
+        self.hed_scale = hed_scale
+        self.latency_budget = latency_budget
+        self.dnn_threads = dnn_threads
+        self.dnn_backend = dnn_backend
+        self.dnn_target = dnn_target
+        self.cache = cache
+        self.max_upload_bytes = max_upload_bytes
+        self.request_timeout = request_timeout
+
+        # the responses are encoded from memory, so nothing goes to disk
+        self.artifacts = ArtifactWriter('none')
+
+        # Stats, the latencies are kept for the last `latency_window` requests
+        self.latencies = deque(maxlen=latency_window)
+        self.queue_waits = deque(maxlen=latency_window)
+        self.counts = {'completed': 0, 'failed': 0, 'rejected': 0, 'batches': 0, 'batched_images': 0}
+        self.in_flight = 0
+
+        # Set when the server starts
+        self.queue = None
+        self.executor = None
+        self.server = None
+        self.batchers = []
+
+    async def start(self):
+        """Warm up (and time) the nets and start listening"""
+        BorderBuilder.configure_dnn(self.dnn_threads, self.dnn_backend, self.dnn_target)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        if self.edge_engine == 'hed':
+            await loop.run_in_executor(self.executor, BorderBuilder.warm_up, self.workers)
+            if self.hed_scale == 'auto':
+                await loop.run_in_executor(self.executor, BorderBuilder.calibrate)
+
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.batchers = [asyncio.create_task(self._batcher()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # port 0 picks a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening and shut the workers down"""
+        self.server.close()
+        await self.server.wait_closed()
+        for batcher in self.batchers:
+            batcher.cancel()
+        await asyncio.gather(*self.batchers, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+        self.artifacts.close()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f'Serving on http://{self.host}:{self.port}')
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+
+    def stats(self):
+        """Queue depth, counters and latency percentiles in milliseconds"""
+        def percentiles(values):
+            if not values:
+                return None
+            p50, p90, p99 = np.percentile(np.array(values) * 1000, [50, 90, 99])
+            return {'p50': p50, 'p90': p90, 'p99': p99, 'max': max(values) * 1000}
+
+        batches = self.counts['batches']
+        return {
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'queue_size': self.queue_size,
+            'in_flight': self.in_flight,
+            **self.counts,
+            'mean_batch_size': self.counts['batched_images'] / batches if batches else None,
+            'latency_ms': percentiles(self.latencies),
+            'queue_wait_ms': percentiles(self.queue_waits)
+        }
+
+
+    async def paint(self, data, output='painting'):
+        """Queue an encoded image and wait for its painting. Raises
+        asyncio.QueueFull if the queue is full.
+        """
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((data, output, future, start))
+        except asyncio.QueueFull:
+            self.counts['rejected'] += 1
+            raise
+
+        try:
+            result = await future
+        except Exception:
+            self.counts['failed'] += 1
+            raise
+        self.counts['completed'] += 1
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    async def _batcher(self):
+        """Take batches off the queue and run them in the executor"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # give concurrent requests a moment to join the batch
+            if self.batch_wait and self.queue.qsize() < self.max_batch_size - 1:
+                await asyncio.sleep(self.batch_wait)
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            now = time.perf_counter()
+            for _, _, _, enqueued in batch:
+                self.queue_waits.append(now - enqueued)
+
+            self.in_flight += len(batch)
+            self.counts['batches'] += 1
+            self.counts['batched_images'] += len(batch)
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self._run_batch, [(data, output) for data, output, _, _ in batch]
+                )
+            except Exception as e:
+                results = [e] * len(batch)
+            finally:
+                self.in_flight -= len(batch)
+
+            for (_, _, future, _), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+    def _run_batch(self, jobs):
+        """Push a batch of encoded images through the pipeline, sharing the HED
+        passes. Returns the encoded output, or the exception, for every job.
+        """
+        results = [None] * len(jobs)
+        pipelines = {}
+        for i, (data, _) in enumerate(jobs):
+            try:
+                image = np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+            except Exception as e:
+                results[i] = ValueError(f'Could not read image: {e}')
+                continue
+            try:
+                mp = MondrianPipeline(
+                    image, in_memory=True, artifacts=self.artifacts,
+                    SIZE=self.SIZE, hed_threshold=self.hed_threshold,
+                    edge_engine=self.edge_engine,
+                    hed_scale=self.hed_scale,
+                    latency_budget=self.latency_budget,
+                    cache=self.cache
+                )
+                mp.resize()
+                mp.find_primary_colors()
+                pipelines[i] = mp
+            except Exception as e:
+                results[i] = e
+
+        MondrianPipeline.find_borders_batch(list(pipelines.values()), max_batch_size=self.max_batch_size)
+
+        for i, mp in pipelines.items():
+            try:
+                mp.find_structure()
+                mp.create_painting()
+                mp.create_overlay()
+                results[i] = self._encode(mp, jobs[i][1])
+            except Exception as e:
+                results[i] = e
+        return results
+
+    @staticmethod
+    def _encode(mp, output):
+        """The response body and content type for a finished pipeline"""
+        def png(image):
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            return buffer.getvalue()
+
+        painting = Image.fromarray(mp.painting.to_array())
+        if output == 'painting':
+            return png(painting), 'image/png'
+        if output == 'overlay':
+            return png(mp.overlay), 'image/png'
+        body = json.dumps({
+            'painting': base64.b64encode(png(painting)).decode(),
+            'overlay': base64.b64encode(png(mp.overlay)).decode()
+        })
+        return body.encode(), 'application/json'
+
+
+    async def _handle_connection(self, reader, writer):
+        """Answer a single HTTP request, then close the connection"""
+        try:
+            response = await asyncio.wait_for(self._handle_request(reader), self.request_timeout)
+        except asyncio.TimeoutError:
+            response = self._response(HTTPStatus.REQUEST_TIMEOUT, 'Request timed out')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            response = self._response(HTTPStatus.BAD_REQUEST, 'Malformed request')
+        except Exception as e:
+            response = self._response(HTTPStatus.INTERNAL_SERVER_ERROR, f'{type(e).__name__}: {e}')
+
+        try:
+            writer.write(response)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise ValueError('bad request line')
+        method, target, _ = request_line
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if url.path == '/health' and method == 'GET':
+            return self._response(HTTPStatus.OK, 'ok')
+
+        if url.path == '/stats' and method == 'GET':
+            return self._response(HTTPStatus.OK, json.dumps(self.stats()), 'application/json')
+
+        if url.path == '/paint' and method == 'POST':
+            output = query.get('output', ['painting'])[0]
+            if output not in OUTPUTS:
+                return self._response(HTTPStatus.BAD_REQUEST, f'output must be one of {", ".join(OUTPUTS)}')
+            if 'content-length' not in headers:
+                return self._response(HTTPStatus.LENGTH_REQUIRED, 'Content-Length is required')
+            length = int(headers['content-length'])
+            if length > self.max_upload_bytes:
+                return self._response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Upload is too large')
+
+            data = await reader.readexactly(length)
+            try:
+                body, content_type = await self.paint(data, output)
+            except asyncio.QueueFull:
+                return self._response(HTTPStatus.SERVICE_UNAVAILABLE, 'Queue is full', headers={'Retry-After': '1'})
+            except ValueError as e:
+                return self._response(HTTPStatus.BAD_REQUEST, str(e))
+            except Exception as e:
+                return self._response(HTTPStatus.INTERNAL_SERVER_ERROR, f'{type(e).__name__}: {e}')
+            return self._response(HTTPStatus.OK, body, content_type)
+
+        if url.path in ('/health', '/stats', '/paint'):
+            return self._response(HTTPStatus.METHOD_NOT_ALLOWED, 'Method not allowed')
+        return self._response(HTTPStatus.NOT_FOUND, 'Not found')
+
+    @staticmethod
+    def _response(status, body, content_type='text/plain', headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        lines = [
+            f'HTTP/1.1 {status.value} {status.phrase}',
+            f'Content-Type: {content_type}',
+            f'Content-Length: {len(body)}',
+            'Connection: close',
+            *[f'{name}: {value}' for name, value in (headers or {}).items()]
+        ]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve Mondrian paintings over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=2, help='batches that run at once, each with its own HED net')
+    parser.add_argument('--queue-size', type=int, default=32, help='uploads that can wait before the server answers 503')
+    parser.add_argument('--max-batch-size', type=int, default=4)
+    parser.add_argument('--batch-wait-ms', type=float, default=10, help='how long a batch waits for more uploads')
+    parser.add_argument('--SIZE', type=int, default=500)
+    parser.add_argument('--hed-threshold', type=int, default=190)
+    parser.add_argument('--edge-engine', choices=EDGE_ENGINES, default='hed')
+    parser.add_argument('--hed-scale', type=parse_hed_scale, default=1.0, help="run HED at this fraction of the size, or 'auto'")
+    parser.add_argument('--latency-budget', type=float, help='seconds of HED per image with --hed-scale auto')
+    parser.add_argument('--dnn-threads', type=int, help="cv2 threads for the whole process, shared by the workers; defaults to cv2's, every core")
+    parser.add_argument('--dnn-backend', choices=BACKENDS)
+    parser.add_argument('--dnn-target', choices=TARGETS)
+    parser.add_argument('--cache-dir', help='cache stage outputs here, and reuse them for repeated uploads')
+    args = parser.parse_args()
+
+    if args.hed_scale == 'auto' and args.latency_budget is None:
+        parser.error('--hed-scale auto needs a --latency-budget')
+
+    service = MondrianService(
+        args.host, args.port,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        max_batch_size=args.max_batch_size,
+        batch_wait=args.batch_wait_ms / 1000,
+        SIZE=args.SIZE,
+        hed_threshold=args.hed_threshold,
+        edge_engine=args.edge_engine,
+        hed_scale=args.hed_scale,
+        latency_budget=args.latency_budget,
+        dnn_threads=args.dnn_threads,
+        dnn_backend=args.dnn_backend,
+        dnn_target=args.dnn_target,
+        cache=StageCache(args.cache_dir) if args.cache_dir else None
+    )
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
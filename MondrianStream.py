@@ -0,0 +1,160 @@
+import argparse
+
+import numpy as np
+import cv2
+
+from helpers.BorderBuilder import BorderBuilder, EDGE_ENGINES, parse_hed_scale
+from helpers.LineBuilder import LineBuilder
+from helpers.ColorBuilder import ColorBuilder
+from helpers.Painting import Painting
+from helpers.images import fit_size, blend
+
+class MondrianStream:
+    """Transform a sequence of frames (a video clip or a webcam feed) into a
+    sequence of Mondrian paintings.
+
+    Running the whole pipeline on every frame is slow and makes the painting
+    flicker, so the structure is only rebuilt on keyframes: every
+    `keyframe_interval` frames, or sooner if the scene changes by more than
+    `scene_threshold` (the mean absolute difference of small grayscale
+    thumbnails, from 0 to 255). Frames in between reuse the last painting,
+    and so do keyframes without any edges.
+    `edge_engine` is passed on to BorderBuilder; 'canny' or 'sobel' keep up
+    with live video far better than HED, as does running HED at a smaller
+    `hed_scale`, or at whatever scale fits `latency_budget` with 'auto'.
+    """
+    def __init__(
+        self,
+        keyframe_interval=30,
+        scene_threshold=20,
+        hed_threshold=190,
+        SIZE=500,
+        edge_engine='hed',
+        hed_scale=1.0,
+        latency_budget=None
+    ):
+        self.keyframe_interval = keyframe_interval
+        self.scene_threshold = scene_threshold
+        self.hed_threshold = hed_threshold
+        self.SIZE = SIZE
+        self.edge_engine = edge_engine
+        self.hed_scale = hed_scale
+        self.latency_budget = latency_budget
+
+        # Vars to be set later
+        self.frame = None
+        self.painting = None
+        self.keyframe_thumbnail = None
+        self.frames_since_keyframe = 0
+        self.keyframes = 0
+
+    def resize(self, frame):
+        """Proportionally resize an RGB frame so its larger side is SIZE"""
+        (height, width) = frame.shape[:2]
+        return cv2.resize(frame, fit_size(width, height, self.SIZE), interpolation=cv2.INTER_AREA)
+
+    def is_keyframe(self, frame):
+        """Decide whether the structure needs to be rebuilt for this frame"""
+        thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY), (32, 32), interpolation=cv2.INTER_AREA)
+
+        if self.keyframe_thumbnail is None or self.frames_since_keyframe >= self.keyframe_interval:
+            changed = True
+        else:
+            difference = np.abs(thumbnail.astype(int) - self.keyframe_thumbnail).mean()
+            changed = difference > self.scene_threshold
+
+        if changed:
+            self.keyframe_thumbnail = thumbnail.astype(int)
+            self.frames_since_keyframe = 0
+        return changed
+
+    def analyze(self, frame):
+        """Run the full pipeline in memory on a resized frame"""
+        color_builder = ColorBuilder(frame)
+        color_builder.get_color_point()
+
+        border_builder = BorderBuilder(
+            frame, hed_threshold=self.hed_threshold, engine=self.edge_engine,
+            hed_scale=self.hed_scale, latency_budget=self.latency_budget
+        )
+        border_builder.apply_hed()
+        border_builder.apply_hed_threshold()
+
+        # A blank keyframe (a black or flat frame, a fade) has no edges to
+        #   cluster. Keep the last painting, or start from the bare frame
+        if len(border_builder.edges) == 0 and self.painting is not None:
+            return
+
+        line_builder = LineBuilder(border_builder.edges)
+        line_builder.analyze_image()
+
+        painting = Painting(line_builder, color_builder)
+        painting.create()
+
+        self.painting = painting
+        self.keyframes += 1
+
+    def paint(self, frames):
+        """Yield a Painting for every RGB frame in `frames`"""
+        for frame in frames:
+            self.frame = self.resize(frame)
+            if self.is_keyframe(self.frame):
+                self.analyze(self.frame)
+            self.frames_since_keyframe += 1
+            yield self.painting
+
+    def overlay(self):
+        """Blend the current frame with the current painting"""
+        return blend(self.frame, self.painting.to_array())
+
+    @staticmethod
+    def frames_from_video(source):
+        """Yield RGB frames from a video file or camera index"""
+        capture = cv2.VideoCapture(source)
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        finally:
+            capture.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transform a video into a Mondrian painting video')
+    parser.add_argument('video_in')
+    parser.add_argument('video_out')
+    parser.add_argument('--keyframe-interval', type=int, default=30)
+    parser.add_argument('--overlay', action='store_true', help='blend each frame with its painting')
+    parser.add_argument('--edge-engine', choices=EDGE_ENGINES, default='hed')
+    parser.add_argument('--hed-scale', type=parse_hed_scale, default=1.0, help="run HED at this fraction of the size, or 'auto'")
+    parser.add_argument('--latency-budget', type=float, help='seconds for each HED pass with --hed-scale auto')
+    args = parser.parse_args()
+
+    if args.hed_scale == 'auto' and args.latency_budget is None:
+        parser.error('--hed-scale auto needs a --latency-budget')
+
+    fps = cv2.VideoCapture(args.video_in).get(cv2.CAP_PROP_FPS) or 30
+
+    stream = MondrianStream(
+        keyframe_interval=args.keyframe_interval, edge_engine=args.edge_engine,
+        hed_scale=args.hed_scale, latency_budget=args.latency_budget
+    )
+    writer = None
+    for painting in stream.paint(MondrianStream.frames_from_video(args.video_in)):
+        frame = stream.overlay() if args.overlay else painting.to_array()
+        if writer is None:
+            writer = cv2.VideoWriter(
+                args.video_out, cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                (frame.shape[1], frame.shape[0])
+            )
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    if writer is not None:
+        writer.release()
+    print(f'Rebuilt the painting on {stream.keyframes} keyframes')
+
+
+if __name__ == '__main__':
+    main()
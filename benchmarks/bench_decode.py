@@ -0,0 +1,131 @@
+"""Time MondrianPipeline.resize on large JPEGs with and without reduced
+decoding, where the JPEG decoder scales the image down while decoding it.
+
+Peak memory is measured in a fresh process for each run, since the decoded
+pixels live outside of Python's allocator.
+
+    python benchmarks/bench_decode.py
+    python benchmarks/bench_decode.py --SIZE 1000 --output decode.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_stages import synthetic_image
+
+SIZES = [(4000, 3000), (6000, 4000)]
+
+
+def peak_memory():
+    """The process's peak resident memory in bytes. ru_maxrss survives exec on
+    Linux, so a child would inherit its parent's peak; VmHWM doesn't.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    # macOS reports ru_maxrss in bytes, Linux in kilobytes
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def resize_once(image_path, SIZE, reduced_decode):
+    """Run resize once and return its wall time, the process's peak memory
+    and the resized pixels
+    """
+    from MondrianPipeline import MondrianPipeline
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        mp = MondrianPipeline(
+            image_path, output_dir=output_dir + '/', in_memory=True,
+            SIZE=SIZE, reduced_decode=reduced_decode
+        )
+        start = time.perf_counter()
+        mp.resize()
+        seconds = time.perf_counter() - start
+    return seconds, peak_memory(), mp.resized
+
+
+def run_case(image_path, SIZE, reduced_decode, repeats):
+    """The best time and peak memory of `repeats` fresh processes"""
+    runs = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, __file__, '--child', image_path, str(SIZE), str(int(reduced_decode))],
+            capture_output=True, text=True, check=True
+        )
+        runs.append(json.loads(result.stdout))
+    return {
+        'seconds': min(run['seconds'] for run in runs),
+        'max_rss': min(run['max_rss'] for run in runs)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reduced-resolution decoding in resize')
+    parser.add_argument('--SIZE', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--quality', type=int, default=90, help='JPEG quality of the test images')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        image_path, SIZE, reduced_decode = args.child
+        seconds, max_rss, _ = resize_once(image_path, int(SIZE), bool(int(reduced_decode)))
+        print(json.dumps({'seconds': seconds, 'max_rss': max_rss}))
+        return
+
+    cases = []
+    with tempfile.TemporaryDirectory() as image_dir:
+        for width, height in SIZES:
+            image_path = os.path.join(image_dir, f'{width}x{height}.jpg')
+            Image.fromarray(synthetic_image(width, height, 'busy')).save(image_path, quality=args.quality)
+
+            full = run_case(image_path, args.SIZE, False, args.repeats)
+            reduced = run_case(image_path, args.SIZE, True, args.repeats)
+
+            # how far the reduced decode drifts from resizing the full image
+            _, _, full_pixels = resize_once(image_path, args.SIZE, False)
+            _, _, reduced_pixels = resize_once(image_path, args.SIZE, True)
+            difference = float(np.abs(full_pixels.astype(np.int16) - reduced_pixels).mean())
+
+            cases.append({
+                'width': width,
+                'height': height,
+                'SIZE': args.SIZE,
+                'full': full,
+                'reduced': reduced,
+                'speedup': full['seconds'] / reduced['seconds'],
+                'mean_abs_difference': difference
+            })
+            print(
+                f"{width}x{height} -> {args.SIZE}: "
+                f"full {full['seconds'] * 1000:.0f}ms {full['max_rss'] / 2 ** 20:.0f}MiB, "
+                f"reduced {reduced['seconds'] * 1000:.0f}ms {reduced['max_rss'] / 2 ** 20:.0f}MiB "
+                f"({full['seconds'] / reduced['seconds']:.1f}x faster, "
+                f"mean difference {difference:.2f}/255)"
+            )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cases': cases}, f, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
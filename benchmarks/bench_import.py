@@ -0,0 +1,91 @@
+"""Measure how long a cold `import MondrianPipeline` takes and check it against a
+budget.
+
+Each run is a fresh interpreter started with `-X importtime`, so the numbers
+include everything a short-lived CLI call or worker pays before doing any
+work. Dependencies that are only needed on optional paths (the debug
+histogram, random downloads, the sklearn engines) must not be imported at all.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --budget 400 --repeats 7
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported lazily by the code paths that need them
+LAZY_MODULES = ['sklearn', 'matplotlib', 'requests', 'wget', 'pygame']
+
+
+def import_profile(module):
+    """Import `module` in a fresh interpreter and return the cumulative import
+    time, in microseconds, of `module` and of each package it imports
+    directly, along with the top level packages that ended up loaded
+    """
+    check = f'import sys, json; import {module}; print(json.dumps(sorted({{m.split(".")[0] for m in sys.modules}})))'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', check],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+    # a package's own imports are listed, indented, just before it
+    times, children = {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == module:
+                times = dict(children, **{module: int(cumulative)})
+            children = {}
+    return times, json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the cold import time against a budget')
+    parser.add_argument('--module', default='MondrianPipeline')
+    parser.add_argument('--budget', type=float, default=500, help='allowed import time in milliseconds')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='how many of the slowest imports to list')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.repeats):
+        times, loaded = import_profile(args.module)
+        runs.append(times)
+
+    # the fastest run is the least disturbed by the rest of the machine
+    best = min(runs, key=lambda times: times[args.module])
+    total = best[args.module] / 1000
+
+    print(f'import {args.module}: {total:.1f}ms (best of {args.repeats}, budget {args.budget:.0f}ms)')
+    slowest = sorted((name for name in best if name != args.module), key=lambda name: -best[name])
+    for name in slowest[:args.top]:
+        print(f'  {best[name] / 1000:8.1f}ms  {name}')
+
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    for name in eager:
+        print(f'EAGER {name} is imported by {args.module} but should be imported lazily')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'module': args.module, 'total_ms': total, 'budget_ms': args.budget,
+                       'imports_ms': {name: best[name] / 1000 for name in slowest}, 'eager': eager}, f, indent=2)
+
+    if total > args.budget:
+        print(f'OVER BUDGET by {total - args.budget:.1f}ms')
+    if total > args.budget or eager:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
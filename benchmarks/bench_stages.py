@@ -0,0 +1,200 @@
+"""Time each stage of the pipeline on deterministic synthetic images.
+
+HED is replaced by a stub that turns the image's gradients into an edge map,
+so no caffemodel is needed. Results are written as JSON; pass an earlier
+results file with --compare to flag stages that got slower.
+
+    python benchmarks/bench_stages.py --output bench.json
+    python benchmarks/bench_stages.py --output new.json --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MondrianPipeline import MondrianPipeline
+from helpers.BorderBuilder import BorderBuilder
+from helpers.LineBuilder import LineBuilder
+from helpers.ColorBuilder import ColorBuilder
+from helpers.Painting import Painting
+from helpers.ArtifactWriter import ArtifactWriter
+
+SIZES = [(640, 480), (1600, 1200), (4000, 3000)]
+
+# number of rectangles and fraction of speckled pixels for each edge density
+DENSITIES = {
+    'sparse': (6, 0.0),
+    'busy': (40, 0.02)
+}
+
+
+def synthetic_image(width, height, density, seed=0):
+    """A deterministic RGB image of overlapping flat rectangles, optionally
+    speckled with noise to produce scattered edge pixels
+    """
+    n_rectangles, speckle = DENSITIES[density]
+    rng = np.random.default_rng(seed)
+
+    image = np.full((height, width, 3), 235, dtype=np.uint8)
+    for _ in range(n_rectangles):
+        x, y = rng.integers(0, width * 0.9), rng.integers(0, height * 0.9)
+        w, h = rng.integers(width // 20, width // 3), rng.integers(height // 20, height // 3)
+        image[y:y + h, x:x + w] = rng.integers(0, 256, 3)
+
+    if speckle:
+        mask = rng.random((height, width)) < speckle
+        image[mask] = rng.integers(0, 256, (mask.sum(), 3))
+    return image
+
+
+class StubBorderBuilder(BorderBuilder):
+    """A BorderBuilder whose 'HED' is the normalized Sobel gradient magnitude"""
+    def apply_hed(self):
+        image = self.read_image()
+        (H, W) = image.shape[:2]
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        magnitude = cv2.magnitude(
+            cv2.Sobel(gray, cv2.CV_32F, 1, 0),
+            cv2.Sobel(gray, cv2.CV_32F, 0, 1)
+        )
+        self.set_hed(np.clip(magnitude / 255, 0, 1), W, H)
+
+
+def timed(function, repeats):
+    """The best wall time of `repeats` calls"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_case(width, height, density, SIZE, repeats, output_dir):
+    """Time every stage for one synthetic image"""
+    image = synthetic_image(width, height, density)
+    stages = {}
+
+    # time the stages themselves, without writing any files in the background
+    mp = MondrianPipeline(
+        image, output_dir=output_dir, in_memory=True, SIZE=SIZE, artifacts=ArtifactWriter('none')
+    )
+
+    def resize():
+        # each step points image_in at the next file, so start from the image
+        mp.image_in = image
+        mp.resize()
+    stages['resize'] = timed(resize, repeats)
+
+    color_builder = ColorBuilder(mp.resized)
+    stages['get_color_point'] = timed(color_builder.get_color_point, repeats)
+
+    border_builder = StubBorderBuilder(mp.resized)
+    stages['apply_hed'] = timed(border_builder.apply_hed, repeats)
+    border_builder.apply_hed_threshold()
+
+    line_builder = LineBuilder(border_builder.edges)
+    stages['get_best_kmeans'] = timed(line_builder.get_best_kmeans, repeats)
+    stages['get_raw_segments'] = timed(line_builder.get_raw_segments, repeats)
+    stages['clean_raw_segments'] = timed(line_builder.clean_raw_segments, repeats)
+    line_builder.build_face_index()
+
+    painting = Painting(line_builder, color_builder)
+    stages['painting'] = timed(painting.create, repeats)
+
+    mp.color_builder, mp.line_builder, mp.painting = color_builder, line_builder, painting
+    stages['overlay'] = timed(mp.create_overlay, repeats)
+
+    return {
+        'width': width,
+        'height': height,
+        'density': density,
+        'SIZE': SIZE,
+        'edge_pixels': len(line_builder.edges),
+        'raw_segments': len(line_builder.raw_segments),
+        'stages': stages,
+        'total': sum(stages.values())
+    }
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """List the stages that are more than `tolerance` (relative) and `min_delta`
+    seconds slower than the baseline
+    """
+    def case_key(case):
+        return (case['width'], case['height'], case['density'], case['SIZE'])
+
+    baseline_cases = {case_key(case): case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        old = baseline_cases.get(case_key(case))
+        if old is None:
+            continue
+        for stage, seconds in case['stages'].items():
+            old_seconds = old['stages'].get(stage)
+            if old_seconds and seconds > old_seconds * (1 + tolerance) and seconds - old_seconds > min_delta:
+                regressions.append({
+                    'case': case_key(case),
+                    'stage': stage,
+                    'baseline': old_seconds,
+                    'seconds': seconds
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark each pipeline stage on synthetic images')
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--compare', help='an earlier results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before a stage is flagged')
+    parser.add_argument('--min-delta', type=float, default=0.002, help='ignore slowdowns smaller than this many seconds')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--SIZE', type=int, default=500)
+    parser.add_argument('--quick', action='store_true', help='only the smallest image size')
+    args = parser.parse_args()
+
+    sizes = SIZES[:1] if args.quick else SIZES
+    cases = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for width, height in sizes:
+            for density in DENSITIES:
+                case = run_case(width, height, density, args.SIZE, args.repeats, output_dir + '/')
+                cases.append(case)
+                stage_times = ', '.join(f'{k} {v * 1000:.1f}ms' for k, v in case['stages'].items())
+                print(f'{width}x{height} {density}: {stage_times}')
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'repeats': args.repeats
+        },
+        'cases': cases
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Wrote {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        for r in regressions:
+            print(f"REGRESSION {r['case']} {r['stage']}: {r['baseline'] * 1000:.1f}ms -> {r['seconds'] * 1000:.1f}ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Compare tiled HED inference with running the whole image through the
+network at once: peak memory, time, and how far the stitched edge map drifts
+from the untiled one, overall and in the bands where tiles overlap.
+
+Each run happens in a fresh process so that its peak memory is its own. HED
+needs the caffemodel in helpers/hed_model.
+
+    python benchmarks/bench_tiles.py
+    python benchmarks/bench_tiles.py --tile-size 400 --overlaps 64,128 --output tiles.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_stages import synthetic_image
+from bench_decode import peak_memory
+
+SIZES = [(1600, 1200)]
+
+
+def hed_once(image_path, tile_size, tile_overlap, hed_path):
+    """Run HED once, save its map to `hed_path` and return the wall time and
+    the process's peak memory
+    """
+    from helpers.BorderBuilder import BorderBuilder
+
+    border_builder = BorderBuilder(
+        np.load(image_path), tile_size=tile_size or None, tile_overlap=tile_overlap
+    )
+    start = time.perf_counter()
+    border_builder.apply_hed()
+    seconds = time.perf_counter() - start
+    np.save(hed_path, border_builder.hed)
+    return seconds, peak_memory()
+
+
+def run_case(image_path, tile_size, tile_overlap, hed_path):
+    """Time one configuration in a fresh process"""
+    result = subprocess.run(
+        [sys.executable, __file__, '--child', image_path, str(tile_size), str(tile_overlap), hed_path],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def overlap_mask(width, height, tile_size, tile_overlap):
+    """True wherever two or more tiles overlap, using the same tile layout as
+    BorderBuilder.apply_hed_tiled
+    """
+    def covered(length):
+        starts = list(range(0, length - tile_size, tile_size - tile_overlap)) + [length - tile_size]
+        counts = np.zeros(length, dtype=int)
+        for start in starts:
+            counts[start:start + tile_size] += 1
+        return counts > 1
+
+    return covered(height)[:, None] | covered(width)[None, :]
+
+
+def compare(untiled, tiled, mask, hed_threshold):
+    """How far a tiled map is from the untiled one"""
+    difference = np.abs(untiled.astype(np.int16) - tiled)
+    flipped = (untiled >= hed_threshold) != (tiled >= hed_threshold)
+    return {
+        'mean_abs_difference': float(difference.mean()),
+        'overlap_mean_abs_difference': float(difference[mask].mean()),
+        'p99_abs_difference': float(np.percentile(difference, 99)),
+        'edge_disagreement': float(flipped.mean())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tiled HED against untiled HED')
+    parser.add_argument('--tile-size', type=int, default=400)
+    parser.add_argument('--overlaps', default='32,64,128,192', help='comma separated tile overlaps to try')
+    parser.add_argument('--hed-threshold', type=int, default=190, help='for counting pixels whose edge decision flips')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        image_path, tile_size, tile_overlap, hed_path = args.child
+        seconds, max_rss = hed_once(image_path, int(tile_size), int(tile_overlap), hed_path)
+        print(json.dumps({'seconds': seconds, 'max_rss': max_rss}))
+        return
+
+    from helpers.BorderBuilder import CAFFEMODEL
+    if not os.path.exists(CAFFEMODEL):
+        parser.error(f'HED needs {CAFFEMODEL}')
+
+    cases = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for width, height in SIZES:
+            image_path = os.path.join(work_dir, f'{width}x{height}.npy')
+            np.save(image_path, synthetic_image(width, height, 'busy'))
+
+            untiled_path = os.path.join(work_dir, 'untiled.npy')
+            untiled = run_case(image_path, 0, 0, untiled_path)
+            untiled_hed = np.load(untiled_path)
+            print(
+                f"{width}x{height} untiled: {untiled['seconds']:.1f}s "
+                f"{untiled['max_rss'] / 2 ** 20:.0f}MiB"
+            )
+
+            for tile_overlap in [int(overlap) for overlap in args.overlaps.split(',')]:
+                tiled_path = os.path.join(work_dir, f'tiled-{tile_overlap}.npy')
+                tiled = run_case(image_path, args.tile_size, tile_overlap, tiled_path)
+                mask = overlap_mask(width, height, args.tile_size, tile_overlap)
+                drift = compare(untiled_hed, np.load(tiled_path), mask, args.hed_threshold)
+
+                cases.append({
+                    'width': width,
+                    'height': height,
+                    'tile_size': args.tile_size,
+                    'tile_overlap': tile_overlap,
+                    'untiled': untiled,
+                    'tiled': tiled,
+                    **drift
+                })
+                print(
+                    f"  {args.tile_size}px tiles, {tile_overlap}px overlap: {tiled['seconds']:.1f}s "
+                    f"{tiled['max_rss'] / 2 ** 20:.0f}MiB, mean difference "
+                    f"{drift['mean_abs_difference']:.2f}/255 "
+                    f"({drift['overlap_mean_abs_difference']:.2f} where tiles overlap), "
+                    f"{drift['edge_disagreement'] * 100:.2f}% of pixels flip edge or not"
+                )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cases': cases}, f, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
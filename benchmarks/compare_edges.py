@@ -0,0 +1,165 @@
+"""Compare BorderBuilder's edge engines on speed and on how closely the
+segments LineBuilder finds from their edges agree with a reference engine.
+
+Agreement is measured on the painting's lines (the frame around the canvas
+is left out, since every engine gets it). A line pixel counts as matched if
+the other engine has a line within --tolerance pixels of it; precision and
+recall are the matched fractions of the engine's and the reference's line
+pixels, and f1 combines the two.
+
+Synthetic images are used unless --images is given. HED needs the caffemodel
+in helpers/hed_model.
+
+    python benchmarks/compare_edges.py --images 'photos/*.jpg'
+    python benchmarks/compare_edges.py --engines canny,sobel --reference canny
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MondrianPipeline import find_images
+from helpers.BorderBuilder import BorderBuilder, EDGE_ENGINES, CAFFEMODEL
+from helpers.LineBuilder import LineBuilder
+from helpers.images import load_array, fit_size
+from bench_stages import synthetic_image, DENSITIES
+
+SYNTHETIC_SIZES = [(640, 480), (1600, 1200)]
+
+
+def line_mask(line_builder):
+    """Draw the segments, minus the canvas frame, one pixel wide"""
+    width, height = line_builder.width, line_builder.height
+    mask = np.zeros((height, width), dtype=bool)
+    for (x1, y1), (x2, y2) in line_builder.segments['x']:
+        x = min(int(round(x1)), width - 1)
+        if x1 not in (0, width):
+            top, bottom = sorted([int(round(y1)), int(round(y2))])
+            mask[top:bottom + 1, x] = True
+    for (x1, y1), (x2, y2) in line_builder.segments['y']:
+        y = min(int(round(y1)), height - 1)
+        if y1 not in (0, height):
+            left, right = sorted([int(round(x1)), int(round(x2))])
+            mask[y, left:right + 1] = True
+    return mask
+
+
+def agreement(mask, reference, tolerance):
+    """Precision, recall and f1 of one line mask against another"""
+    def matched(a, b):
+        # distance from every pixel to the nearest line pixel of b
+        if not b.any():
+            return 0.0 if a.any() else 1.0
+        distance = cv2.distanceTransform((~b).astype(np.uint8), cv2.DIST_L2, 3)
+        return float((distance[a] <= tolerance).mean()) if a.any() else 1.0
+
+    precision, recall = matched(mask, reference), matched(reference, mask)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def run_engine(image, engine, hed_threshold, repeats):
+    """Time one engine on an RGB image and find the segments from its edges"""
+    border_builder = BorderBuilder(image, hed_threshold=hed_threshold, engine=engine)
+
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        border_builder.apply_hed()
+        best = min(best, time.perf_counter() - start)
+    border_builder.apply_hed_threshold()
+
+    line_builder = LineBuilder(border_builder.edges)
+    start = time.perf_counter()
+    line_builder.analyze_image()
+    structure_seconds = time.perf_counter() - start
+
+    return line_builder, {
+        'edge_seconds': best,
+        'structure_seconds': structure_seconds,
+        'edge_pixels': len(border_builder.edges),
+        'segments': len(line_builder.segments['x']) + len(line_builder.segments['y'])
+    }
+
+
+def load_images(source, SIZE):
+    """(name, RGB array at SIZE) for the given images, or synthetic ones"""
+    if source is None:
+        for width, height in SYNTHETIC_SIZES:
+            for density in DENSITIES:
+                image = synthetic_image(width, height, density)
+                yield f'{width}x{height}-{density}', cv2.resize(image, fit_size(width, height, SIZE), interpolation=cv2.INTER_AREA)
+        return
+
+    for path in find_images(source):
+        image = load_array(path)
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        image = image[:, :, :3]
+        (height, width) = image.shape[:2]
+        yield path, cv2.resize(image, fit_size(width, height, SIZE), interpolation=cv2.INTER_AREA)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare edge engines on speed and segment agreement')
+    parser.add_argument('--images', help='a directory or glob of images, instead of synthetic ones')
+    parser.add_argument('--engines', default=','.join(EDGE_ENGINES))
+    parser.add_argument('--reference', default='hed', help='the engine the others are compared to')
+    parser.add_argument('--tolerance', type=float, default=4, help='how many pixels apart lines may be and still match')
+    parser.add_argument('--hed-threshold', type=int, default=190)
+    parser.add_argument('--SIZE', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    engines = args.engines.split(',')
+    if args.reference not in engines:
+        engines.insert(0, args.reference)
+    for engine in engines:
+        if engine not in EDGE_ENGINES:
+            parser.error(f'unknown engine {engine}, choose from {", ".join(EDGE_ENGINES)}')
+    if 'hed' in engines and not os.path.exists(CAFFEMODEL):
+        parser.error(f'HED needs {CAFFEMODEL}; compare the other engines with --reference')
+
+    cases = []
+    for name, image in load_images(args.images, args.SIZE):
+        line_builders, results = {}, {}
+        for engine in engines:
+            line_builders[engine], results[engine] = run_engine(image, engine, args.hed_threshold, args.repeats)
+
+        reference = line_mask(line_builders[args.reference])
+        for engine in engines:
+            if engine != args.reference:
+                results[engine].update(agreement(line_mask(line_builders[engine]), reference, args.tolerance))
+
+        cases.append({'image': name, 'engines': results})
+        print(name)
+        for engine, result in results.items():
+            agreement_text = f", f1 {result['f1']:.2f}" if 'f1' in result else ' (reference)'
+            print(
+                f"  {engine:6s} edges {result['edge_seconds'] * 1000:7.1f}ms, "
+                f"{result['edge_pixels']} edge pixels, {result['segments']} segments{agreement_text}"
+            )
+
+    print('mean over all images')
+    for engine in engines:
+        seconds = np.mean([case['engines'][engine]['edge_seconds'] for case in cases])
+        summary = f'  {engine:6s} edges {seconds * 1000:7.1f}ms'
+        if engine != args.reference:
+            summary += f", f1 {np.mean([case['engines'][engine]['f1'] for case in cases]):.2f}"
+        print(summary)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'reference': args.reference, 'tolerance': args.tolerance, 'cases': cases}, f, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""A smoke test for MondrianService over real HTTP on localhost.
+
+Starts the server on a free port and checks that:
+  - POST /paint returns a painting that decodes as a PNG
+  - GET /health answers ok and GET /stats counts the painting
+  - once the queue is full, POST /paint answers 503 with Retry-After, and the
+    uploads that were queued still finish
+
+To fill the queue deterministically, the server's only worker thread is held
+busy while the uploads arrive. Canny is the default edge engine so that no
+model is needed; pass --edge-engine hed to go through the network too.
+Exits with status 1 on the first failed check.
+
+    python benchmarks/smoke_service.py
+    python benchmarks/smoke_service.py --edge-engine hed
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import urllib.error
+import urllib.request
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MondrianService import MondrianService
+from helpers.BorderBuilder import EDGE_ENGINES
+from bench_stages import synthetic_image
+
+
+def check(condition, message):
+    """Stop the smoke test if a check fails"""
+    if not condition:
+        print(f'FAIL: {message}')
+        sys.exit(1)
+    print(f'ok: {message}')
+
+
+def request(url, data=None, timeout=60):
+    """(status, headers, body) of a GET, or a POST if there's data"""
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=timeout) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def start_service(service):
+    """Run the service's event loop in a background thread. Returns the loop
+    once the server is listening.
+    """
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(service.start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    if not started.wait(120):
+        raise RuntimeError('The service did not start')
+    return loop
+
+
+def wait_for(condition, timeout=30):
+    """Poll until `condition()` is true or the timeout passes"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Smoke test MondrianService on localhost')
+    parser.add_argument('--edge-engine', choices=EDGE_ENGINES, default='canny')
+    parser.add_argument('--queue-size', type=int, default=2)
+    args = parser.parse_args()
+
+    upload = io.BytesIO()
+    Image.fromarray(synthetic_image(320, 240, 'sparse')).save(upload, 'JPEG')
+    upload = upload.getvalue()
+
+    # one worker and batches of one, so holding that worker stalls the queue
+    service = MondrianService(
+        port=0, workers=1, queue_size=args.queue_size, max_batch_size=1, batch_wait=0,
+        edge_engine=args.edge_engine
+    )
+    loop = start_service(service)
+    url = f'http://127.0.0.1:{service.port}'
+    print(f'Serving on {url}')
+
+    def stats():
+        return json.loads(request(f'{url}/stats')[2])
+
+    try:
+        status, headers, body = request(f'{url}/paint', upload)
+        check(status == 200 and headers['Content-Type'] == 'image/png', f'/paint answered {status}')
+        painting = Image.open(io.BytesIO(body))
+        check(painting.format == 'PNG' and painting.size[0] > 0, f'the painting is a {painting.size} PNG')
+
+        status, _, body = request(f'{url}/health')
+        check(status == 200 and body == b'ok', '/health answered ok')
+
+        check(stats()['completed'] == 1, '/stats counted the painting')
+
+        # Hold the only worker thread so nothing leaves the queue
+        release = threading.Event()
+        service.executor.submit(release.wait)
+
+        # the batcher takes one upload off the queue, then the queue fills
+        results = []
+        senders = [
+            threading.Thread(target=lambda: results.append(request(f'{url}/paint', upload)[0]))
+            for _ in range(args.queue_size + 1)
+        ]
+        for sender in senders:
+            sender.start()
+        check(
+            wait_for(lambda: stats()['queue_depth'] == args.queue_size),
+            f'the queue filled up to {args.queue_size}'
+        )
+
+        status, headers, _ = request(f'{url}/paint', upload)
+        check(status == 503 and headers['Retry-After'] is not None, f'a full queue answered {status} with Retry-After')
+
+        release.set()
+        for sender in senders:
+            sender.join(120)
+        check(results == [200] * len(senders), f'the queued uploads finished with {results}')
+
+        final = stats()
+        check(final['rejected'] == 1 and final['completed'] == len(senders) + 1, 'the stats add up')
+    finally:
+        asyncio.run_coroutine_threadsafe(service.stop(), loop).result(60)
+        loop.call_soon_threadsafe(loop.stop)
+
+    print('Service smoke test passed')
+
+
+if __name__ == '__main__':
+    main()
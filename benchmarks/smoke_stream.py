@@ -0,0 +1,61 @@
+"""A smoke test for MondrianStream on a synthetic clip.
+
+Checks that:
+  - every frame gets a painting, and the structure is only rebuilt on keyframes
+  - a clip that opens on black frames starts from the bare frame
+  - black keyframes in the middle of a clip keep the last painting
+
+Canny is the default edge engine so that no model is needed; pass
+--edge-engine hed to go through the network too. Exits with status 1 on the
+first failed check.
+
+    python benchmarks/smoke_stream.py
+    python benchmarks/smoke_stream.py --edge-engine hed
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MondrianStream import MondrianStream
+from helpers.BorderBuilder import EDGE_ENGINES
+from bench_stages import synthetic_image
+from smoke_service import check
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Smoke test MondrianStream on a synthetic clip')
+    parser.add_argument('--edge-engine', choices=EDGE_ENGINES, default='canny')
+    parser.add_argument('--keyframe-interval', type=int, default=5)
+    args = parser.parse_args()
+
+    scene = synthetic_image(320, 240, 'sparse')
+    black = np.zeros_like(scene)
+
+    def stream():
+        return MondrianStream(keyframe_interval=args.keyframe_interval, edge_engine=args.edge_engine)
+
+    # a scene, a cut to black, then the scene again
+    clip = [scene] * 12 + [black] * 12 + [scene] * 6
+    mondrian_stream = stream()
+    paintings = list(mondrian_stream.paint(clip))
+    check(len(paintings) == len(clip), f'{len(paintings)} paintings for {len(clip)} frames')
+    check(mondrian_stream.keyframes < len(clip), f'the structure was rebuilt on {mondrian_stream.keyframes} keyframes')
+    check(all(painting is paintings[11] for painting in paintings[12:24]), 'the black keyframes kept the last painting')
+
+    # a clip that opens on black
+    mondrian_stream = stream()
+    paintings = list(mondrian_stream.paint([black] * 3 + [scene] * 3))
+    bare = paintings[0].layout['segments']
+    check(len(bare['x']) == len(bare['y']) == 2, 'a black first keyframe painted the bare frame')
+    check(paintings[0].to_array().size > 0, 'the bare frame renders')
+    check(paintings[-1] is not paintings[0], 'the scene replaced the bare frame')
+
+    print('Stream smoke test passed')
+
+
+if __name__ == '__main__':
+    main()
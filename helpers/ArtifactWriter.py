@@ -0,0 +1,98 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Each level writes everything the levels before it do
+LEVELS = ('none', 'final', 'all', 'debug')
+
+
+class ArtifactWriter:
+    """Writes a pipeline's files from a small pool of background threads so
+    that encoding and saving them stays off the critical path.
+
+    Every artifact has a level: `final` for the painting and overlay, `all`
+    for the intermediate images (resize, HED, threshold) and `debug` for the
+    matplotlib histogram of the structure. Only artifacts at or below the
+    writer's `level` are written, and `none` writes nothing at all. The
+    painting and overlay are written as `image_format`; the other artifacts
+    keep their own formats (the threshold image stays a lossless PNG).
+
+    At most `max_pending` artifacts wait to be written; past that `submit`
+    blocks until a thread catches up. Call `flush` to wait for everything
+    submitted so far, which raises the first error any write ran into, and
+    `close` (or leave a `with` block) to stop the threads when you're done.
+    """
+    def __init__(self, level='final', image_format='jpg', workers=2, max_pending=16):
+        if level not in LEVELS:
+            raise ValueError(f'level must be one of {", ".join(LEVELS)}')
+        self.level = level
+        self.image_format = image_format
+        self.workers = workers
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._errors = []
+        self._executor = None
+
+    def wants(self, level):
+        """True if artifacts of the given level are written"""
+        return LEVELS.index(level) <= LEVELS.index(self.level) and self.level != 'none'
+
+    def path(self, filename, level):
+        """`filename` with its extension swapped for `image_format` if it's a
+        painting or overlay (a `final` artifact), otherwise unchanged
+        """
+        if level != 'final':
+            return filename
+        return f'{os.path.splitext(filename)[0]}.{self.image_format}'
+
+    def submit(self, level, function, *args):
+        """Call `function(*args)` in the background if `level` is wanted"""
+        if not self.wants(level):
+            return None
+
+        self._slots.acquire()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            future = self._executor.submit(self._write, function, *args)
+            self._pending.append(future)
+        return future
+
+    def _write(self, function, *args):
+        try:
+            function(*args)
+        except Exception as e:
+            with self._lock:
+                self._errors.append(e)
+        finally:
+            self._slots.release()
+
+    def flush(self):
+        """Wait for every artifact submitted so far to be written"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """Flush, then stop the threads. A later `submit` starts new ones."""
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                executor, self._executor = self._executor, None
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,72 +1,348 @@
-from PIL import Image
+import numpy as np
 import cv2
 import os
+import time
+import math
+
+from helpers.images import is_array
+from helpers.NetRegistry import net_registry
+from helpers.EdgeMap import EdgeMap
+from helpers.ClassicEdges import ClassicEdges
+
+PROTOTXT = os.path.dirname(__file__) + "/hed_model/deploy.prototxt"
+CAFFEMODEL = os.path.dirname(__file__) + "/hed_model/hed_pretrained_bsds.caffemodel"
+MEAN = (104.00698793, 116.66876762, 122.67891434)
+
+EDGE_ENGINES = ('hed',) + ClassicEdges.METHODS
+
+# HED's deepest side output sees about 196px (VGG16's conv5_3), so a pixel's
+#   edge depends on about 100px of context on every side. Tiles overlap by more
+#   than that, so each tile's starved border is blended out. See
+#   benchmarks/bench_tiles.py for how far tiled maps drift at other overlaps.
+TILE_OVERLAP = 128
+
+# The smallest inference scale 'auto' will go to, past this HED misses too much
+MIN_HED_SCALE = 0.25
+# The side of the blank image that a model's speed is first measured on
+CALIBRATION_SIZE = 256
+
+
+def parse_hed_scale(value):
+    """Read a hed_scale from the command line: 'auto' or a number"""
+    return value if value == 'auto' else float(value)
+
 
 class BorderBuilder:
     """BorderBuilder is a class that helps apply Holisticly-Nested Edge Detection
     to an image so that we can get the major features of an image.
+
+    `image_in` can be a path to an image or an RGB NumPy array.
+
+    Images with a side longer than `tile_size` are run through HED in tiles
+    that overlap by `tile_overlap` pixels (see TILE_OVERLAP), whose edge maps
+    are blended together, so `tile_size` rather than the image size bounds
+    the network's memory use.
+
+    `engine` picks the edge detector behind `apply_hed`: 'hed' for the
+    network, or 'canny' or 'sobel' for the much faster ClassicEdges, which
+    needs no model. It can also be any object with a `detect` method that
+    takes a BGR image and returns an edge map from 0 to 1 of the same size,
+    and that has a `cache_key` string if its output should be cached.
+
+    HED's run time grows with the number of pixels, so `hed_scale` below 1 runs
+    the network on a smaller copy of the image and scales the edge map back up.
+    With `hed_scale='auto'` the scale is picked per image so that the forward
+    pass should take about `latency_budget` seconds, from the registry's
+    running estimate of the model's speed (measured once on a blank image if
+    the model hasn't run yet). `inference_scale` is left at the scale used.
     """
     def __init__(
         self, 
         image_in,
-        prototxt=os.path.dirname(__file__) + "/hed_model/deploy.prototxt",
-        caffemodel=os.path.dirname(__file__) + "/hed_model/hed_pretrained_bsds.caffemodel",
-        hed_threshold=190
+        prototxt=PROTOTXT,
+        caffemodel=CAFFEMODEL,
+        hed_threshold=190,
+        tile_size=None,
+        tile_overlap=TILE_OVERLAP,
+        engine='hed',
+        hed_scale=1.0,
+        latency_budget=None
     ):
         self.image_in = image_in
         self.prototxt = prototxt
         self.caffemodel = caffemodel
         self.hed_threshold = hed_threshold
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+
+        if tile_size is not None and tile_overlap >= tile_size:
+            raise ValueError('tile_overlap must be smaller than tile_size')
+        if isinstance(engine, str) and engine not in EDGE_ENGINES:
+            raise ValueError(f'engine must be one of {", ".join(EDGE_ENGINES)}')
+        self.engine = engine
+
+        if hed_scale == 'auto':
+            if latency_budget is None:
+                raise ValueError("hed_scale='auto' needs a latency_budget")
+        elif not 0 < hed_scale <= 1:
+            raise ValueError("hed_scale must be between 0 and 1, or 'auto'")
+        self.hed_scale = hed_scale
+        self.latency_budget = latency_budget
 
         # Vars to be set later
         self.hed = None
-        self.pos_ids = None
+        self.edges = None
+        self.inference_scale = None
 
-    def apply_hed(self):
-        """Apply HED to the input image"""
-        # Load neural network
-        net = cv2.dnn.readNetFromCaffe(
-            self.prototxt, 
-            self.caffemodel
+    def read_image(self):
+        """Return the input image as a BGR array, the ordering HED expects"""
+        if not is_array(self.image_in):
+            return cv2.imread(self.image_in)
+
+        if self.image_in.ndim == 2:
+            return cv2.cvtColor(self.image_in, cv2.COLOR_GRAY2BGR)
+        return cv2.cvtColor(self.image_in, cv2.COLOR_RGB2BGR)
+
+    @staticmethod
+    def warm_up(n=1, prototxt=PROTOTXT, caffemodel=CAFFEMODEL):
+        """Load `n` copies of the HED network into the shared registry ahead of
+        time, e.g. once per worker at startup.
+        """
+        net_registry.warm_up(prototxt, caffemodel, n)
+
+    @staticmethod
+    def configure_dnn(threads=None, backend=None, target=None):
+        """Set cv2's thread count and the backend and target HED runs on, for
+        the whole process. With several workers, give each one a share of the
+        cores rather than letting every one of them use all of them.
+        """
+        net_registry.configure(threads, backend, target)
+
+    @staticmethod
+    def forward(net, blob, prototxt, caffemodel):
+        """Run a blob through a net and record how long it took"""
+        start = time.perf_counter()
+        net.setInput(blob)
+        out = net.forward()
+        pixels = blob.shape[0] * blob.shape[2] * blob.shape[3]
+        net_registry.record(prototxt, caffemodel, pixels, time.perf_counter() - start)
+        return out
+
+    @staticmethod
+    def calibrate(prototxt=PROTOTXT, caffemodel=CAFFEMODEL):
+        """Measure how fast the model runs on this machine"""
+        image = np.full((CALIBRATION_SIZE, CALIBRATION_SIZE, 3), 127, dtype=np.uint8)
+        blob = cv2.dnn.blobFromImage(
+            image, scalefactor=1.0, size=(CALIBRATION_SIZE, CALIBRATION_SIZE),
+            mean=MEAN,
+            swapRB=False, crop=False
         )
+        with net_registry.checkout(prototxt, caffemodel) as net:
+            # the first pass on a net also sets it up, so only time the second
+            net.setInput(blob)
+            net.forward()
+            BorderBuilder.forward(net, blob, prototxt, caffemodel)
+
+    def pick_scale(self, W, H):
+        """The scale HED should run at for a W x H image"""
+        if self.hed_scale != 'auto':
+            return self.hed_scale
+
+        seconds_per_pixel = net_registry.seconds_per_pixel(self.prototxt, self.caffemodel)
+        if seconds_per_pixel is None:
+            BorderBuilder.calibrate(self.prototxt, self.caffemodel)
+            seconds_per_pixel = net_registry.seconds_per_pixel(self.prototxt, self.caffemodel)
+
+        scale = math.sqrt(self.latency_budget / (seconds_per_pixel * W * H))
+        return min(max(scale, MIN_HED_SCALE), 1.0)
 
-        image = cv2.imread(self.image_in)
+    def scale_image(self, image):
+        """Shrink a BGR image to the size HED should run at"""
         (H, W) = image.shape[:2]
+        self.inference_scale = self.pick_scale(W, H)
+        if self.inference_scale >= 1:
+            return image
+
+        size = (max(1, round(W * self.inference_scale)), max(1, round(H * self.inference_scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def needs_tiles(self, image):
+        """True if the image is too large to go through HED in one piece"""
+        return self.tile_size is not None and max(image.shape[:2]) > self.tile_size
+
+    def uses_hed(self):
+        """True if the edges come from the HED network"""
+        return isinstance(self.engine, str) and self.engine == 'hed'
+
+    def apply_detector(self, image):
+        """Find the edges of a BGR image with a detector other than HED"""
+        detector = self.engine
+        if isinstance(detector, str):
+            detector = ClassicEdges(detector)
+        (H, W) = image.shape[:2]
+        self.set_hed(detector.detect(image), W, H)
+
+    def apply_hed(self):
+        """Apply HED (or the chosen engine) to the input image"""
+        image = self.read_image()
+        if not self.uses_hed():
+            self.apply_detector(image)
+            return
+
+        (H, W) = image.shape[:2]
+        image = self.scale_image(image)
+        if self.needs_tiles(image):
+            self.apply_hed_tiled(image, (W, H))
+            return
+
+        (h, w) = image.shape[:2]
 
         blob = cv2.dnn.blobFromImage(
-            image, scalefactor=1.0, size=(W, H),
-            mean=(104.00698793, 116.66876762, 122.67891434),
+            image, scalefactor=1.0, size=(w, h),
+            mean=MEAN,
             swapRB=False, crop=False
         )
 
-        # Apply neural network and store output image
-        net.setInput(blob)
-        hed = net.forward()
-        hed = cv2.resize(hed[0, 0], (W, H))
+        # Apply neural network (loaded once per process) and store output 
+        #   image, scaled back up to the full size
+        with net_registry.checkout(self.prototxt, self.caffemodel) as net:
+            hed = BorderBuilder.forward(net, blob, self.prototxt, self.caffemodel)
+        self.set_hed(hed[0, 0], W, H)
+
+    def apply_hed_tiled(self, image, size=None):
+        """Apply HED to overlapping tiles of a BGR image and stitch the edge 
+        maps together. Each tile's contribution fades out linearly across the
+        overlap so that no seams show where tiles meet. The edge map is stored
+        at `size` (W, H), or the image's own size.
+        """
+        (H, W) = image.shape[:2]
+        tile, overlap = self.tile_size, self.tile_overlap
+
+        def tile_starts(length):
+            """Where the tiles along one side begin, with the last one flush to the end"""
+            if length <= tile:
+                return [0]
+            starts = list(range(0, length - tile, tile - overlap))
+            return starts + [length - tile]
+
+        def ramp(length, at_start, at_end):
+            """Blend weights along one side of a tile"""
+            weights = np.ones(length, dtype=np.float32)
+            fade = np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+            if not at_start:
+                weights[:overlap] = fade
+            if not at_end:
+                weights[-overlap:] = fade[::-1]
+            return weights
+
+        edges = np.zeros((H, W), dtype=np.float32)
+        total_weight = np.zeros((H, W), dtype=np.float32)
+
+        with net_registry.checkout(self.prototxt, self.caffemodel) as net:
+            for y in tile_starts(H):
+                for x in tile_starts(W):
+                    patch = image[y:y + tile, x:x + tile]
+                    (h, w) = patch.shape[:2]
+
+                    blob = cv2.dnn.blobFromImage(
+                        patch, scalefactor=1.0, size=(w, h),
+                        mean=MEAN,
+                        swapRB=False, crop=False
+                    )
+                    hed = BorderBuilder.forward(net, blob, self.prototxt, self.caffemodel)[0, 0]
+
+                    weight = np.outer(
+                        ramp(h, y == 0, y + h == H),
+                        ramp(w, x == 0, x + w == W)
+                    )
+                    edges[y:y + h, x:x + w] += hed * weight
+                    total_weight[y:y + h, x:x + w] += weight
+
+        self.set_hed(edges / total_weight, *(size or (W, H)))
+
+    def set_hed(self, hed, W, H):
+        """Store a raw HED output map as a uint8 image of size W x H"""
+        hed = cv2.resize(hed, (W, H))
         hed = (255 * hed).astype("uint8")
 
         self.hed = hed
 
+    @staticmethod
+    def apply_hed_batch(border_builders, max_batch_size=8, pad=False):
+        """Apply HED to several BorderBuilders with as few forward passes as
+        possible.
+
+        Images of the same shape are grouped into buckets of at most 
+        `max_batch_size` and each bucket runs through the network as a single
+        blob. With `pad=True`, images of different shapes share a bucket by
+        being reflect-padded to the bucket's largest height and width; the
+        padding is cropped away from each edge map afterward.
+        """
+        buckets = {}
+        for border_builder in border_builders:
+            image = border_builder.read_image()
+
+            # Only HED is batched, other engines run one image at a time
+            if not border_builder.uses_hed():
+                border_builder.apply_detector(image)
+                continue
+
+            (H, W) = image.shape[:2]
+            image = border_builder.scale_image(image)
+
+            # Images that need tiles go through the network on their own
+            if border_builder.needs_tiles(image):
+                border_builder.apply_hed_tiled(image, (W, H))
+                continue
+
+            key = (border_builder.prototxt, border_builder.caffemodel)
+            if not pad:
+                key += image.shape[:2]
+            buckets.setdefault(key, []).append((border_builder, image, (W, H)))
+
+        for key, members in buckets.items():
+            prototxt, caffemodel = key[:2]
+            for start in range(0, len(members), max_batch_size):
+                chunk = members[start:start + max_batch_size]
+
+                H = max(image.shape[0] for _, image, _ in chunk)
+                W = max(image.shape[1] for _, image, _ in chunk)
+                images = [
+                    cv2.copyMakeBorder(
+                        image, 0, H - image.shape[0], 0, W - image.shape[1],
+                        cv2.BORDER_REFLECT_101
+                    ) for _, image, _ in chunk
+                ]
+
+                blob = cv2.dnn.blobFromImages(
+                    images, scalefactor=1.0, size=(W, H),
+                    mean=MEAN,
+                    swapRB=False, crop=False
+                )
+
+                with net_registry.checkout(prototxt, caffemodel) as net:
+                    hed = BorderBuilder.forward(net, blob, prototxt, caffemodel)
+
+                # Split the batch back into one edge map per image, at full size
+                for i, (border_builder, image, size) in enumerate(chunk):
+                    (h, w) = image.shape[:2]
+                    border_builder.set_hed(np.ascontiguousarray(hed[i, 0, :h, :w]), *size)
+
     def save_hed(self, file):
         """Save HED's output image to the given file"""
         cv2.imwrite(file, self.hed)
 
 
     def apply_hed_threshold(self):
-        """Apply a cutoff so that all values in the array are minmaxed 
-        into a binary.
+        """Apply a cutoff to get a binary EdgeMap. `hed` is left untouched so 
+        other thresholds can be tried.
         """
-        n_array = self.hed
-        n_array[n_array < self.hed_threshold] = 0
-        n_array[n_array >= self.hed_threshold] = 250
-
-        self.pos_ids = n_array
+        self.edges = EdgeMap.from_mask(self.hed >= self.hed_threshold)
 
 
     def save_threshold(self, file):
         """Save the threshold image into the given file"""
-        im2 = Image.fromarray(self.pos_ids)
-        im2.save(file)
+        self.edges.save(file)
 
 
 class CropLayer(object):
@@ -104,6 +380,6 @@ class CropLayer(object):
 
 # HACK: We need to add this layer, but it can only be done once, and it seems
 #   like cv2 keeps settings from previous runs to save on memory? And there's no 
-#   straightforward way to ensure that this crop layer was added. Loading it once 
-#   outside the class seems to work best.
-cv2.dnn_registerLayer("Crop", CropLayer)
+#   straightforward way to ensure that this crop layer was added. The registry
+#   adds it once, right before it loads the first net.
+net_registry.register_layer("Crop", CropLayer)
@@ -1,18 +1,19 @@
-from PIL import Image
 import numpy as np
-from scipy.spatial.distance import euclidean as distance
 
 from helpers.colors import mondrian_palette
+from helpers.images import open_image
 
 class ColorBuilder:
     """
     ColorBuilder is a class that determines the colors used in a Mondrian painting.
+
+    `image_in` can be a path to an image or an RGB NumPy array.
     """
 
     def __init__(self, image_in):
         self.image_in = image_in
 
-        im = Image.open(image_in)
+        im = open_image(image_in)
         self.height = im.height
         self.width = im.width
 
@@ -29,43 +30,51 @@ class ColorBuilder:
         self.primary_color = None
         self.primary_color_box = None
 
-    def get_color_point(self, REDUCE=5):
+    def get_color_point(self, REDUCE=1):
         """Find the point on the image that falls closest to the primary colors
         in Mondrian's palette. Set that point and it's respective mondrian color
         as the instance variables `primary_color_coordinate` and `primary_color`
 
-        Comparing every pixel in an image to a palette can be a lengthy process. 
-        The variable `REDUCE` shrinks the image proportionally to reduce runtime.
+        Every pixel is compared to the whole palette with NumPy broadcasting, so 
+        the full resolution image is used by default. The variable `REDUCE` can
+        still shrink the image proportionally to reduce runtime.
         """
 
-        im = Image.open(self.image_in)
+        im = open_image(self.image_in)
         new_height = self.height // REDUCE
         new_width = self.width // REDUCE
-        im = im.resize((new_width, new_height))
-
-        im_array = np.asarray(im)
-        colors_flat = im_array.reshape((-1, 3))
-
-        closest = min([
-            min([{
-                    'id': i,
-                    'mondrian_color': mc,
-                    'image_color': ic,
-                    'distance': distance(mc, ic)
-                } for mc in self.primary_color_palette], key=lambda x: x['distance']) 
-             for i, ic in enumerate(colors_flat)
-        ], key=lambda x: x['distance'])
-
-        small_coordinates = [closest['id'] % new_width, closest['id'] // new_width]
+        if REDUCE != 1:
+            im = im.resize((new_width, new_height))
+
+        im_array = np.asarray(im.convert('RGB'))
+        colors_flat = im_array.reshape((-1, 3)).astype(np.int32)
+
+        # Squared distances keep the same ordering as euclidean distances and
+        #   stay exact in integers. Ties go to the first pixel, then to the 
+        #   first palette color, as they did when comparing one pair at a time.
+        palette = np.array(self.primary_color_palette, dtype=np.int32)
+        best_distance = np.full(len(colors_flat), np.iinfo(np.int32).max)
+        best_color = np.zeros(len(colors_flat), dtype=int)
+        for i, mc in enumerate(palette):
+            d = ((colors_flat - mc) ** 2).sum(axis=1)
+            closer = d < best_distance
+            best_distance[closer] = d[closer]
+            best_color[closer] = i
+
+        closest_id = int(np.argmin(best_distance))
+
+        small_coordinates = [closest_id % new_width, closest_id // new_width]
         large_coordinates = [small_coordinates[0]*REDUCE, small_coordinates[1]*REDUCE]
 
         self.primary_color_coordinate = large_coordinates
-        self.primary_color = closest['mondrian_color']
+        self.primary_color = self.primary_color_palette[best_color[closest_id]]
 
 
-    def get_color_box(self, segments):
+    def get_color_box(self, segments, face_index=None):
         """Given the cleaned segments provided by a LineBuilder, find the box 
-        that the primary_color_coordinate point is surrounded by.
+        that the primary_color_coordinate point is surrounded by. If the 
+        LineBuilder's `face_index` is given, the box is looked up there instead
+        of scanning the segments.
         """
         def between(p, seg, ind):
             return (seg[0][ind] <= p[ind] <= seg[1][ind]) or (seg[1][ind] <= p[ind] <= seg[0][ind])
@@ -83,6 +92,9 @@ class ColorBuilder:
         if point[1] == height:
             point[1] -= 1
 
+        if face_index is not None:
+            self.primary_color_box = face_index.box_at(point)
+            return self.primary_color_box
 
         # Filter through all horizontal segments
         horiz_segs = segments['y']
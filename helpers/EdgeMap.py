@@ -0,0 +1,102 @@
+from PIL import Image
+import numpy as np
+
+from helpers.images import load_array
+
+# The value edge pixels had in the old thresholded images, and still have
+#   when an edge map is saved or shown
+EDGE_VALUE = 250
+
+# The number of set bits in every byte
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class EdgeMap:
+    """A binary edge image, stored as packed bits (one bit per pixel).
+
+    The coordinates of the edge pixels are only materialized when they're
+    asked for, as int16 arrays (int32 for images wider or taller than int16
+    allows), in row-major order like `np.argwhere`. `row_counts` and
+    `column_counts` are the number of edge pixels in each row and column.
+    """
+    def __init__(self, bits, width, height):
+        self.bits = bits
+        self.width = width
+        self.height = height
+
+        # Computed when first needed
+        self._ys = None
+        self._xs = None
+        self._row_counts = None
+        self._column_counts = None
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Pack a boolean (height, width) array"""
+        height, width = mask.shape
+        return cls(np.packbits(mask, axis=1), width, height)
+
+    @classmethod
+    def from_image(cls, image_in):
+        """Read a thresholded image (a path or an array). Pixels brighter than
+        half of EDGE_VALUE count as edges, so a lossy file still mostly works.
+        """
+        return cls.from_mask(load_array(image_in) > EDGE_VALUE // 2)
+
+    @classmethod
+    def empty(cls, width, height):
+        """An edge map with no edges"""
+        return cls(np.zeros((height, (width + 7) // 8), dtype=np.uint8), width, height)
+
+    def to_mask(self):
+        """Unpack into a boolean (height, width) array"""
+        return np.unpackbits(self.bits, axis=1, count=self.width).astype(bool)
+
+    def to_array(self):
+        """Unpack into a uint8 image with edges at EDGE_VALUE and 0 elsewhere"""
+        return np.unpackbits(self.bits, axis=1, count=self.width) * np.uint8(EDGE_VALUE)
+
+    def save(self, filename):
+        """Save as an image. Use a lossless format if it will be read back."""
+        Image.fromarray(self.to_array()).save(filename)
+
+    def _coordinates(self):
+        if self._ys is None:
+            dtype = np.int16 if max(self.width, self.height) <= np.iinfo(np.int16).max else np.int32
+            ys, xs = np.nonzero(self.to_mask())
+            self._ys, self._xs = ys.astype(dtype), xs.astype(dtype)
+        return self._ys, self._xs
+
+    @property
+    def ys(self):
+        """The row of every edge pixel"""
+        return self._coordinates()[0]
+
+    @property
+    def xs(self):
+        """The column of every edge pixel"""
+        return self._coordinates()[1]
+
+    @property
+    def row_counts(self):
+        if self._row_counts is None:
+            self._row_counts = np.bincount(self.ys, minlength=self.height)
+        return self._row_counts
+
+    @property
+    def column_counts(self):
+        if self._column_counts is None:
+            self._column_counts = np.bincount(self.xs, minlength=self.width)
+        return self._column_counts
+
+    def __len__(self):
+        """The number of edge pixels"""
+        if self._ys is not None:
+            return len(self._ys)
+        return int(POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        """Bytes held by the bits and whatever has been materialized"""
+        held = [self.bits, self._ys, self._xs, self._row_counts, self._column_counts]
+        return sum(array.nbytes for array in held if array is not None)
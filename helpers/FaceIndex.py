@@ -0,0 +1,82 @@
+from bisect import bisect_right
+
+import numpy as np
+
+class FaceIndex:
+    """The faces that a LineBuilder's segments divide the canvas into.
+
+    Every line coordinate cuts the canvas into a grid of elementary cells.
+    Neighboring cells that no segment separates are merged into one face, and
+    each face is stored as the box [x, y, width, height] around its cells.
+    Looking up the face around a point is then two binary searches.
+    """
+    def __init__(self, segments, width, height):
+        self.width = width
+        self.height = height
+
+        self.xs = sorted({seg[0][0] for seg in segments['x']} | {0, width})
+        self.ys = sorted({seg[0][1] for seg in segments['y']} | {0, height})
+        nx, ny = len(self.xs) - 1, len(self.ys) - 1
+
+        # walls[i, j] is True when a segment runs along the near edge of a cell
+        x_mids = (np.array(self.xs[:-1], dtype=float) + self.xs[1:]) / 2
+        y_mids = (np.array(self.ys[:-1], dtype=float) + self.ys[1:]) / 2
+
+        x_positions = {x: i for i, x in enumerate(self.xs)}
+        y_positions = {y: j for j, y in enumerate(self.ys)}
+
+        vertical_walls = np.zeros((nx + 1, ny), dtype=bool)
+        for (x, y1), (_, y2) in segments['x']:
+            i = x_positions[x]
+            vertical_walls[i] |= (min(y1, y2) <= y_mids) & (y_mids <= max(y1, y2))
+
+        horizontal_walls = np.zeros((nx, ny + 1), dtype=bool)
+        for (x1, y), (x2, _) in segments['y']:
+            j = y_positions[y]
+            horizontal_walls[:, j] |= (min(x1, x2) <= x_mids) & (x_mids <= max(x1, x2))
+
+        # flood fill the cells into faces
+        labels = np.full((nx, ny), -1)
+        faces = []
+        for i in range(nx):
+            for j in range(ny):
+                if labels[i, j] != -1:
+                    continue
+
+                label = len(faces)
+                labels[i, j] = label
+                stack = [(i, j)]
+                cells = []
+                while stack:
+                    ci, cj = stack.pop()
+                    cells.append((ci, cj))
+                    neighbors = [
+                        (ci - 1, cj, vertical_walls[ci, cj]),
+                        (ci + 1, cj, vertical_walls[ci + 1, cj]),
+                        (ci, cj - 1, horizontal_walls[ci, cj]),
+                        (ci, cj + 1, horizontal_walls[ci, cj + 1])
+                    ]
+                    for ni, nj, wall in neighbors:
+                        if not wall and 0 <= ni < nx and 0 <= nj < ny and labels[ni, nj] == -1:
+                            labels[ni, nj] = label
+                            stack.append((ni, nj))
+
+                cells = np.array(cells)
+                x1, y1 = self.xs[cells[:, 0].min()], self.ys[cells[:, 1].min()]
+                x2, y2 = self.xs[cells[:, 0].max() + 1], self.ys[cells[:, 1].max() + 1]
+                faces.append([x1, y1, x2 - x1, y2 - y1])
+
+        self.labels = labels
+        self.faces = faces
+
+    def face_at(self, point):
+        """Return the index of the face containing `point`. Points on a line
+        belong to the face to its right or below it.
+        """
+        i = min(max(bisect_right(self.xs, point[0]) - 1, 0), len(self.xs) - 2)
+        j = min(max(bisect_right(self.ys, point[1]) - 1, 0), len(self.ys) - 2)
+        return self.labels[i, j]
+
+    def box_at(self, point):
+        """Return the box [x, y, width, height] of the face containing `point`"""
+        return self.faces[self.face_at(point)]
@@ -0,0 +1,112 @@
+import numpy as np
+
+# Upper bound on the number of cells evaluated at once while filling the table
+BLOCK_CELLS = 2 ** 20
+
+class KMeans1D:
+    """Optimal k-means for one dimensional integer data like pixel coordinates.
+
+    The values are collapsed into a weighted histogram and clustered with
+    dynamic programming over its sorted bins, so the cost depends on the number
+    of distinct values (at most the image width or height) and not on the
+    number of edge pixels. A fitted model has the same `n_clusters`, `labels_`,
+    `cluster_centers_` and `inertia_` attributes as sklearn's KMeans.
+    """
+    def __init__(self, n_clusters):
+        self.n_clusters = n_clusters
+
+        # Vars to be set later
+        self.labels_ = None
+        self.cluster_centers_ = None
+        self.inertia_ = None
+
+    def fit(self, X, sample_weight=None):
+        """Fit the model to an array of shape (n_samples, 1)"""
+        return KMeans1D.fit_range(X, (self.n_clusters, self.n_clusters + 1), sample_weight)[0]
+
+    @staticmethod
+    def fit_range(X, k_range, sample_weight=None, counts=None):
+        """Fit one model for every n_clusters in `range(*k_range)`. All of them
+        come out of a single dynamic programming table.
+
+        If X holds non-negative integers and their histogram is already known
+        (`counts[v]` is the number of times v appears in X), passing it as
+        `counts` saves sorting X.
+
+        There can't be more clusters than distinct values, so only the
+        n_clusters that fit are returned, or a single model with one cluster
+        per distinct value if none of them do. Empty input is a ValueError.
+        """
+        X = np.asarray(X).reshape(-1)
+        if len(X) == 0:
+            raise ValueError('KMeans1D needs at least one value to cluster')
+        if counts is not None and sample_weight is None:
+            values = np.flatnonzero(counts)
+            weights = counts[values].astype(float)
+            # the bin of every value, without sorting
+            inverse = (np.cumsum(counts > 0) - 1)[X]
+        else:
+            values, inverse = np.unique(X, return_inverse=True)
+            if sample_weight is None:
+                weights = np.bincount(inverse).astype(float)
+            else:
+                weights = np.bincount(inverse, weights=sample_weight)
+
+        # Centering keeps the prefix sums small enough to avoid cancellation
+        offset = values.mean()
+        centered = values - offset
+
+        n = len(values)
+        ks = [k for k in range(*k_range) if k <= n] or [n]
+        k_max = max(ks)
+
+        # Prefix sums give the within-cluster sum of squares of any run of bins
+        #   in constant time
+        W = np.concatenate([[0], np.cumsum(weights)])
+        S = np.concatenate([[0], np.cumsum(weights * centered)])
+        Q = np.concatenate([[0], np.cumsum(weights * centered ** 2)])
+
+        def cost(i, j):
+            """Sum of squares of the clusters spanning bins i..j (broadcasts)"""
+            sw = W[j + 1] - W[i]
+            s = S[j + 1] - S[i]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.maximum(Q[j + 1] - Q[i] - s * s / sw, 0)
+
+        # D[k, j] is the best cost of splitting bins 0..j into k+1 clusters and
+        #   B[k, j] is the first bin of the last of those clusters
+        D = np.full((k_max, n), np.inf)
+        B = np.zeros((k_max, n), dtype=int)
+        D[0] = cost(0, np.arange(n))
+
+        # Fill each row a block of end bins at a time to bound memory
+        block = max(1, BLOCK_CELLS // n)
+        for k in range(1, k_max):
+            starts = np.arange(k, n)
+            for first in range(k, n, block):
+                ends = np.arange(first, min(first + block, n))[:, None]
+                candidates = D[k - 1, starts - 1] + cost(starts, ends)
+                candidates[starts > ends] = np.inf
+                best = np.argmin(candidates, axis=1)
+                D[k, ends[:, 0]] = candidates[np.arange(len(ends)), best]
+                B[k, ends[:, 0]] = starts[best]
+
+        models = []
+        for k in ks:
+            # Walk back through the table to find where each cluster starts
+            bin_labels = np.zeros(n, dtype=int)
+            centers = np.zeros((k, 1))
+            j = n - 1
+            for cluster in range(k - 1, -1, -1):
+                i = B[cluster, j]
+                bin_labels[i:j + 1] = cluster
+                centers[cluster, 0] = np.average(values[i:j + 1], weights=weights[i:j + 1])
+                j = i - 1
+
+            model = KMeans1D(k)
+            model.labels_ = bin_labels[inverse]
+            model.cluster_centers_ = centers
+            model.inertia_ = float(D[k - 1, n - 1])
+            models.append(model)
+
+        return models
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+from helpers.KMeans1D import KMeans1D
+
+class KMeansSweep:
+    """Fit sklearn KMeans models for every k in `k_range` on both axes of a
+    LineBuilder, more cheaply than fitting each one from scratch.
+
+    The x and y axes are fit concurrently. Each k is seeded with the centers of
+    the k-1 model plus the point farthest from them, so only one initialization
+    is needed. When an axis has more than `coreset_threshold` edge pixels the
+    models are fit on a uniform sample of `coreset_size` of them, weighted to
+    stand in for the rest, and then used to label every pixel.
+    """
+    def __init__(
+        self,
+        k_range=(2, 7),
+        coreset_threshold=20000,
+        coreset_size=5000,
+        random_state=0
+    ):
+        self.k_range = k_range
+        self.coreset_threshold = coreset_threshold
+        self.coreset_size = coreset_size
+        self.random_state = random_state
+
+    def fit_axis(self, values):
+        """Fit one model for every k in k_range to a 1-D array of coordinates"""
+        X_full = np.asarray(values, dtype=float).reshape(-1, 1)
+        X, sample_weight = X_full, None
+
+        if len(X_full) > self.coreset_threshold:
+            rng = np.random.default_rng(self.random_state)
+            sample = rng.choice(len(X_full), size=self.coreset_size, replace=False)
+            X = X_full[sample]
+            sample_weight = np.full(len(X), len(X_full) / len(X))
+
+        models = []
+        centers = None
+        for k in range(*self.k_range):
+            if centers is None:
+                kmeans = KMeans(n_clusters=k, n_init=1, random_state=self.random_state)
+            else:
+                # warm start from the previous solution plus its worst fit point
+                distances = ((X - centers.T) ** 2).min(axis=1)
+                init = np.vstack([centers, X[np.argmax(distances)]])
+                kmeans = KMeans(n_clusters=k, init=init, n_init=1)
+
+            kmeans.fit(X, sample_weight=sample_weight)
+            centers = kmeans.cluster_centers_
+
+            # get_raw_segments needs a label for every edge pixel
+            if X is not X_full:
+                kmeans.labels_ = kmeans.predict(X_full)
+
+            models.append(kmeans)
+
+        return models
+
+    def fit(self, all_x, all_y):
+        """Fit both axes concurrently and return (models_x, models_y)"""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future_x = executor.submit(self.fit_axis, all_x)
+            future_y = executor.submit(self.fit_axis, all_y)
+            return future_x.result(), future_y.result()
+
+    def report(self, model, values):
+        """Describe how far a chosen model is from the exact k-means optimum on
+        every value of its axis
+        """
+        values = np.asarray(values)
+        inertia = -model.score(values.reshape(-1, 1).astype(float))
+        optimal_inertia = KMeans1D(model.n_clusters).fit(values).inertia_
+
+        return {
+            'n_clusters': model.n_clusters,
+            'coreset': len(values) > self.coreset_threshold,
+            'inertia': inertia,
+            'optimal_inertia': optimal_inertia,
+            'relative_gap': (inertia - optimal_inertia) / optimal_inertia if optimal_inertia else 0.0
+        }
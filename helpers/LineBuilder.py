@@ -1,40 +1,70 @@
-from PIL import Image
+from math import hypot
+
 import numpy as np
-from sklearn.cluster import KMeans
-from scipy.stats import mode
-import matplotlib.pyplot as plt
-from scipy.spatial.distance import euclidean as distance
+
+from helpers.EdgeMap import EdgeMap
+from helpers.KMeans1D import KMeans1D
+from helpers.LineIndex import LineIndex
+from helpers.FaceIndex import FaceIndex
 
 class LineBuilder:
-    """Create the segments from an image"""
-    def __init__(self, image_in, min_percent_split=.1):
-        self.image_in = image_in
+    """Create the segments from an image
+
+    `edges` is an EdgeMap (`BorderBuilder.edges`), or a path to a thresholded
+    HED image or the image's array.
+    """
+    def __init__(self, edges, min_percent_split=.1):
+        if not isinstance(edges, EdgeMap):
+            edges = EdgeMap.from_image(edges)
+        self.edges = edges
         self.min_percent_split = min_percent_split
 
-        im = Image.open(image_in)
-        self.width = im.width
-        self.height = im.height
-
-        n = np.array(im)
-        self.pos_ids = np.argwhere(n == 250)
-        self.all_x = self.pos_ids[:, 1]
-        self.all_y = self.pos_ids[:, 0]
+        self.width = edges.width
+        self.height = edges.height
 
         # Vars to set later
         self.segments = None
         self.raw_segments = None
         self.kmeansy = None
         self.kmeansx = None
+        self.kmeans_report = None
+        self.face_index = None
+
+
+    @property
+    def all_x(self):
+        """The x coordinate of every edge pixel"""
+        return self.edges.xs
+
+    @property
+    def all_y(self):
+        """The y coordinate of every edge pixel"""
+        return self.edges.ys
+
 
+    def get_best_kmeans(self, k_range=(2, 7), engine='histogram'):
+        """Run kmeans models on the x axis and the y axis for the given k_range
 
-    def get_best_kmeans(self, k_range=(2, 7)):
-        """Run kmeans models on the x axis and the y axis for the given k_range"""
+        The default `histogram` engine clusters each axis exactly with KMeans1D.
+        The `sklearn` engine fits sklearn's KMeans on every edge pixel instead,
+        and the `sweep` engine fits them with KMeansSweep: both axes at once, 
+        warm-started, and on a coreset for busy images. The `sweep` engine also
+        sets `kmeans_report`, the gap between each chosen model and the exact
+        optimum.
+
+        With no edge pixels (a blank or flat image) there's nothing to cluster,
+        so no models are set and the painting is just the frame.
+        """
         def get_top_models(kmeans_models, n=5):
             """Given a list of kmeans models, use "max percent difference" as a 
             heuristic to determine which model has the appropriate number of clusters.
+            With fewer than three models there's nothing to compare, so the one with 
+            the most clusters is used.
             """
             def perc(a, b):
                 """get the percent difference between two values"""
+                if a == b == 0:
+                    return 0
                 return abs(a - b)/((a+b)*.5)
             
             inertias = [x.inertia_ for x in kmeans_models]
@@ -46,11 +76,30 @@ class LineBuilder:
             
             model_indices = [x+1 for x in max_diff_indices]
             
-            return [m for i, m in enumerate(kmeans_models) if i in model_indices]
+            return [m for i, m in enumerate(kmeans_models) if i in model_indices] or kmeans_models[-1:]
+
+        # only the sweep engine reports, so don't leave an earlier run's report behind
+        self.kmeans_report = None
+
+        if len(self.edges) == 0:
+            self.kmeansx = self.kmeansy = None
+            return
 
         # Create a kmeans model for x and y with n_clusters equal to each value in k_range
-        all_kmeansy = [KMeans(n_clusters=i).fit(self.all_y.reshape(-1, 1)) for i in range(*k_range)]
-        all_kmeansx = [KMeans(n_clusters=i).fit(self.all_x.reshape(-1, 1)) for i in range(*k_range)]
+        if engine == 'histogram':
+            all_kmeansy = KMeans1D.fit_range(self.all_y, k_range, counts=self.edges.row_counts)
+            all_kmeansx = KMeans1D.fit_range(self.all_x, k_range, counts=self.edges.column_counts)
+        elif engine == 'sklearn':
+            # sklearn takes about a second to import, so only pay for it here
+            from sklearn.cluster import KMeans
+            all_kmeansy = [KMeans(n_clusters=i).fit(self.all_y.reshape(-1, 1)) for i in range(*k_range)]
+            all_kmeansx = [KMeans(n_clusters=i).fit(self.all_x.reshape(-1, 1)) for i in range(*k_range)]
+        elif engine == 'sweep':
+            from helpers.KMeansSweep import KMeansSweep
+            sweep = KMeansSweep(k_range)
+            all_kmeansx, all_kmeansy = sweep.fit(self.all_x, self.all_y)
+        else:
+            raise ValueError(f'Unknown kmeans engine: {engine}')
 
         top_kmeansy = get_top_models(all_kmeansy)
         top_kmeansx = get_top_models(all_kmeansx)
@@ -58,81 +107,75 @@ class LineBuilder:
         self.kmeansy = top_kmeansy[0]
         self.kmeansx = top_kmeansx[0]
 
+        if engine == 'sweep':
+            self.kmeans_report = {
+                'x': sweep.report(self.kmeansx, self.all_x),
+                'y': sweep.report(self.kmeansy, self.all_y)
+            }
+
 
     def get_raw_segments(self, buffer_quantile=0.05):
         """Combine logic with the kmeans models to get the raw segments"""
         def threshold_split(input_l, min_percent_split):
-            """Split an input list if the difference between any values is 
+            """Split an input array if the difference between any values is 
             greater than the given threshold
             """
             max_diff = int(min_percent_split * self.width)
-            return_l = []
 
-            # Make sure the list is sorted
-            input_l = sorted(input_l)
-            
-            # Add values to `contiguous` unless the difference between the values
-            #   is too great, then append to the return list.
-            contiguous = []
-            for i, val in enumerate(input_l[:-1]):
-                if input_l[i+1] - input_l[i] > max_diff:
-                    return_l.append(contiguous)
-                    contiguous = []
-                else:
-                    contiguous.append(val)
-            if contiguous != []:
-                return_l.append(contiguous)
-            
-            # Filter out any lists that are only one point long
+            # Make sure the array is sorted
+            input_l = np.sort(input_l)
+            if len(input_l) < 2:
+                return []
+
+            # A value is kept unless the gap after it is too great, in which case
+            #   it closes its run. The last value is never kept.
+            gaps = np.diff(input_l) > max_diff
+            run_ids = np.cumsum(gaps) - gaps
+            kept = input_l[:-1][~gaps]
+            kept_run_ids = run_ids[~gaps]
+
+            return_l = np.split(kept, np.flatnonzero(np.diff(kept_run_ids)) + 1)
+
+            # Filter out any runs that are only one point long
             return_l = [x for x in return_l if len(x) > 1]
 
             return return_l
 
         raw_segments = []
-        all_x, all_y = self.all_x, self.all_y
-
-        kmeans = self.kmeansx
-        for cc_x, label in zip(kmeans.cluster_centers_, range(kmeans.n_clusters)):
-            # get the mode of the x values in this cluster
-            group_x = all_x[kmeans.labels_ == label]
-            m = mode(group_x).mode[0]
-            group_x = group_x.tolist()
-
-            # get all the y values that correspond to the x values in this cluster
-            y_bound = [p[0] for p in self.pos_ids if p[1] in group_x]
-            assert len(y_bound) == len(group_x)
-
-            # Use the range of those y values to create the segments
-            #   Use `buffer_quantile` as a way to drop outliers and `threshold_split`
-            #   as a way to help split up multimodal distributions
-            y_bounds = threshold_split(y_bound, self.min_percent_split)
-            for yb in y_bounds:
-                raw_segments.append([[m, np.quantile(yb, buffer_quantile)], [m, np.quantile(yb, 1-buffer_quantile)]])
-
-        # repeat for y
-        kmeans = self.kmeansy
-        for cc_y, label in zip(kmeans.cluster_centers_, range(kmeans.n_clusters)):
-            group_y = all_y[kmeans.labels_ == label]
-            m = mode(group_y).mode[0]
-            group_y = group_y.tolist()
-            x_bound = [p[1] for p in self.pos_ids if p[0] in group_y]
-            assert len(x_bound) == len(group_y)
-            x_bounds = threshold_split(x_bound, self.min_percent_split)
-            for xb in x_bounds:
-                raw_segments.append([[np.quantile(xb, buffer_quantile), m], [np.quantile(xb, 1-buffer_quantile), m]])
+        if self.kmeansx is None:
+            # no edge pixels, so no segments
+            self.raw_segments = raw_segments
+            return
+
+        # The x clusters make vertical segments and the y clusters horizontal ones
+        for vertical, kmeans in ((True, self.kmeansx), (False, self.kmeansy)):
+            values, others = (self.all_x, self.all_y) if vertical else (self.all_y, self.all_x)
+
+            # group the edge pixels by cluster label in one pass
+            order = np.argsort(kmeans.labels_, kind='stable')
+            bounds = np.cumsum(np.bincount(kmeans.labels_, minlength=kmeans.n_clusters))[:-1]
+            groups = zip(np.split(values[order], bounds), np.split(others[order], bounds))
+
+            for group_values, group_others in groups:
+                # get the mode of the values in this cluster
+                m = np.bincount(group_values).argmax()
+
+                # Use the range of the other coordinate to create the segments
+                #   Use `buffer_quantile` as a way to drop outliers and `threshold_split`
+                #   as a way to help split up multimodal distributions
+                bounds_other = threshold_split(group_others, self.min_percent_split)
+                for b in bounds_other:
+                    low, high = np.quantile(b, [buffer_quantile, 1-buffer_quantile])
+                    if vertical:
+                        raw_segments.append([[m, low], [m, high]])
+                    else:
+                        raw_segments.append([[low, m], [high, m]])
 
         self.raw_segments = raw_segments
 
 
     def clean_raw_segments(self):
-        def intersects_y(y, seg):
-            low_y, high_y = min(seg[1][1], seg[0][1]), max(seg[1][1], seg[0][1])
-            return low_y <= y <= high_y
-
-        def intersects_x(x, seg):
-            low_x, high_x = min(seg[1][0], seg[0][0]), max(seg[1][0], seg[0][0])
-            return low_x <= x <= high_x
-        
+        """Extend each raw segment to the closest existing perpendicular lines"""
         width = self.width
         height = self.height
 
@@ -142,11 +185,17 @@ class LineBuilder:
             'y': [[[0, 0], [width, 0]], [[0, height], [width, height]]]
         } 
 
-        # a shorthand for "any index"
-        a = 0
+        # index the lines as they're added so the closest crossing line is
+        #   usually found near a binary search rather than by scanning every line
+        vertical_lines = LineIndex()
+        for (x, y1), (_, y2) in new_segments['x']:
+            vertical_lines.add(x, y1, y2)
+        horizontal_lines = LineIndex()
+        for (x1, y), (x2, _) in new_segments['y']:
+            horizontal_lines.add(y, x1, x2)
 
         # sort raw segments in descending order by size so that we prioritize larger segments
-        raw_segments_sorted = sorted(self.raw_segments, key=lambda x: -distance(x[0], x[1]))
+        raw_segments_sorted = sorted(self.raw_segments, key=lambda x: -hypot(x[1][0] - x[0][0], x[1][1] - x[0][1]))
 
         # extend each raw segment to the closest existing line
         for seg in raw_segments_sorted:
@@ -155,49 +204,59 @@ class LineBuilder:
                 y = y1
                 x1, x2 = min([x1, x2]), max([x1, x2])
                 
-                # get the closest vertical segment that
-                new_x1 = min([
-                    { 'new_x': seg[a][0], 'delta': abs(x1 - seg[a][0]) }
-                 for seg in new_segments['x'] if intersects_y(y, seg)
-                ], key=lambda t: t['delta'])['new_x']
+                # get the closest vertical line that crosses y
+                new_x1 = vertical_lines.nearest(x1, y)
                 
                 # repeat the process, but don't let the segment collapse to a point.
-                new_x2 = min([
-                    { 'new_x': seg[a][0], 'delta': abs(seg[a][0] - x2) }
-                 for seg in new_segments['x'] if seg[a][0] != new_x1 and intersects_y(y, seg)
-                ], key=lambda t: t['delta'])['new_x']
+                new_x2 = vertical_lines.nearest(x2, y, exclude=new_x1)
                 
                 new_segments['y'].append([[new_x1, y], [new_x2, y]])
+                horizontal_lines.add(y, new_x1, new_x2)
             
             # repeat for vertical segments
             else:
                 x = x1
                 y1, y2 = min([y1, y2]), max([y1, y2])
                 
-                new_y1 = min([{ 'new_y': seg[a][1], 'delta': abs(y1 - seg[a][1]) }
-                 for seg in new_segments['y'] if intersects_x(x, seg)
-                ], key=lambda t: t['delta'])['new_y']
-                
-                new_y2 = min([{ 'new_y': seg[a][1], 'delta': abs(seg[a][1] - y2) }
-                 for seg in new_segments['y'] if seg[a][1] != new_y1 and intersects_x(x, seg)
-                ], key=lambda t: t['delta'])['new_y']
+                new_y1 = horizontal_lines.nearest(y1, x)
+                new_y2 = horizontal_lines.nearest(y2, x, exclude=new_y1)
                 
                 new_segments['x'].append([[x, new_y1], [x, new_y2]])
+                vertical_lines.add(x, new_y1, new_y2)
         
         self.segments = new_segments
 
 
-    def analyze_image(self):
+    def build_face_index(self):
+        """Index the boxes that the cleaned segments divide the canvas into"""
+        self.face_index = FaceIndex(self.segments, self.width, self.height)
+
+
+    @classmethod
+    def from_segments(cls, segments, width, height, min_percent_split=.1):
+        """Rebuild a LineBuilder from segments found earlier, e.g. in a cache"""
+        line_builder = cls(EdgeMap.empty(width, height), min_percent_split)
+        line_builder.segments = segments
+        line_builder.build_face_index()
+        return line_builder
+
+
+    def analyze_image(self, k_range=(2, 7)):
         """Usher image through pipeline"""    
-        self.get_best_kmeans()
+        self.get_best_kmeans(k_range)
         self.get_raw_segments()
         self.clean_raw_segments()
+        self.build_face_index()
 
 
     def create_histogram(self, filename, hist_size=0.65, fig_size=8):
         """Put histograms on the axes and sketch the raw segments to help 
         understand what the kmeans models are doing.
         """
+        # a bare Figure rather than pyplot, so that histograms can be drawn 
+        #   from background threads without sharing pyplot's global state
+        from matplotlib.figure import Figure
+
         def draw_raw_segments(raw_segments, ax):
             """Place the raw segments onto the given axis"""
             for seg in raw_segments:
@@ -229,7 +288,7 @@ class LineBuilder:
         rect_histx = [left, bottom + hist_height, hist_width, 0.2]
         rect_histy = [left + hist_width, bottom, 0.2, hist_height]
 
-        fig = plt.figure(figsize=(fig_size, fig_size))
+        fig = Figure(figsize=(fig_size, fig_size))
 
         ax = fig.add_axes(rect_scatter)
         ax.tick_params(axis='x', which='both', bottom=False, top=False, labelbottom=False)
@@ -250,7 +309,7 @@ class LineBuilder:
         ax_histy.tick_params(axis="x", labelbottom=False, bottom=False)
         ax_histy.tick_params(axis="y", labelleft=False)
 
-        ax.imshow(Image.open(self.image_in), cmap='Greys')
+        ax.imshow(self.edges.to_array(), cmap='Greys')
 
         bin_proportion = 0.6
         binsx = int(self.width*bin_proportion)
@@ -262,7 +321,6 @@ class LineBuilder:
         draw_raw_segments(self.raw_segments, ax)
 
         fig.savefig(filename)
-        plt.close('all')
 
     def save(self, filename):
         """Save the histogram to filename"""
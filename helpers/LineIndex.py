@@ -0,0 +1,70 @@
+from bisect import bisect_left, insort
+
+class LineIndex:
+    """A coordinate-sorted index of parallel, axis-aligned lines.
+
+    Each line sits at a `coordinate` (x for vertical lines, y for horizontal
+    ones) and spans `start` to `end` along the other axis. `nearest` answers
+    "which line crossing this point is closest to that coordinate" by binary
+    searching to the coordinate and walking outward until nothing left can be
+    closer. That's usually a few steps, but when the nearby lines don't cross
+    the point it still looks at every line, so the worst case is linear.
+    """
+    def __init__(self):
+        self.coordinates = []
+        self.lines = {}
+        self.count = 0
+
+    def add(self, coordinate, start, end):
+        """Add a line. Lines remember the order they were added in."""
+        if coordinate not in self.lines:
+            insort(self.coordinates, coordinate)
+            self.lines[coordinate] = []
+
+        low, high = min(start, end), max(start, end)
+        self.lines[coordinate].append((low, high, self.count, coordinate))
+        self.count += 1
+
+    def _first_crossing(self, coordinate, at):
+        """The earliest added line at `coordinate` that crosses `at`, if any"""
+        for low, high, order, value in self.lines[coordinate]:
+            if low <= at <= high:
+                return order, value
+        return None
+
+    def nearest(self, target, at, exclude=None):
+        """Return the coordinate of the line closest to `target` among the
+        lines that cross `at`, skipping lines at `exclude`. Ties go to the line
+        that was added first, as they would in a linear scan. Raises a
+        ValueError if no line crosses `at`.
+        """
+        coordinates = self.coordinates
+        left = bisect_left(coordinates, target) - 1
+        right = left + 1
+
+        best = None
+        while left >= 0 or right < len(coordinates):
+            left_delta = target - coordinates[left] if left >= 0 else float('inf')
+            right_delta = coordinates[right] - target if right < len(coordinates) else float('inf')
+
+            if left_delta <= right_delta:
+                delta, coordinate = left_delta, coordinates[left]
+                left -= 1
+            else:
+                delta, coordinate = right_delta, coordinates[right]
+                right += 1
+
+            # Everything left to visit is farther away than the best match
+            if best is not None and delta > best[0]:
+                break
+
+            if coordinate == exclude:
+                continue
+
+            crossing = self._first_crossing(coordinate, at)
+            if crossing is not None and (best is None or (delta, crossing[0]) < best[:2]):
+                best = (delta, crossing[0], crossing[1])
+
+        if best is None:
+            raise ValueError(f'no line crosses {at}')
+        return best[2]
@@ -0,0 +1,68 @@
+import os
+import json
+
+class MetricsRecorder:
+    """A hook for MondrianPipeline that collects one record per stage.
+
+    Each record is a dict with the `stage`, the `image`, its `wall_time` and
+    `cpu_time` in seconds, `peak_memory` (the most bytes Python allocated at
+    once during the stage, if memory tracing is on), `max_rss` (the process's
+    resident memory high-water mark in bytes, None on Windows) and stage
+    specific `counters`.
+    Records can be written as JSON lines or as a Prometheus text file.
+    """
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def write_json_lines(self, filename):
+        """Append the records to a file, one JSON object per line"""
+        with open(filename, 'a') as f:
+            for record in self.records:
+                f.write(json.dumps(record) + '\n')
+
+    def prometheus(self, prefix='mondrian'):
+        """Summarize the records in the Prometheus text exposition format"""
+        runs, wall, cpu, memory, counters = {}, {}, {}, {}, {}
+        for record in self.records:
+            stage = record['stage']
+            runs[stage] = runs.get(stage, 0) + 1
+            wall[stage] = wall.get(stage, 0) + record['wall_time']
+            cpu[stage] = cpu.get(stage, 0) + record['cpu_time']
+            if record['peak_memory'] is not None:
+                memory[stage] = max(memory.get(stage, 0), record['peak_memory'])
+            for name, value in record['counters'].items():
+                counters[(stage, name)] = value
+
+        lines = []
+        def metric(name, kind, description, values):
+            if not values:
+                return
+            lines.append(f'# HELP {prefix}_{name} {description}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for labels, value in values.items():
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f'{prefix}_{name}{{{label_text}}} {value}')
+
+        def by_stage(values):
+            return {(('stage', stage),): value for stage, value in values.items()}
+
+        metric('stage_runs_total', 'counter', 'Number of times each stage ran', by_stage(runs))
+        metric('stage_wall_seconds_total', 'counter', 'Wall time spent in each stage', by_stage(wall))
+        metric('stage_cpu_seconds_total', 'counter', 'CPU time spent in each stage', by_stage(cpu))
+        metric('stage_peak_memory_bytes', 'gauge', 'Largest Python allocation peak of each stage', by_stage(memory))
+        metric('stage_counter', 'gauge', 'Last value of each stage counter', {
+            (('stage', stage), ('counter', name)): value for (stage, name), value in counters.items()
+        })
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename, prefix='mondrian'):
+        """Write the Prometheus summary to a file, e.g. for a textfile collector.
+        The file is replaced in one step so a scraper never sees half of it.
+        """
+        tmp_filename = f'{filename}.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(self.prometheus(prefix))
+        os.replace(tmp_filename, filename)
@@ -0,0 +1,190 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import cv2
+
+# Names for cv2's DNN backends and targets. The constants are looked up when a
+#   net is configured, since a given cv2 build may not have all of them.
+BACKENDS = {
+    'default': 'DNN_BACKEND_DEFAULT',
+    'opencv': 'DNN_BACKEND_OPENCV',
+    'openvino': 'DNN_BACKEND_INFERENCE_ENGINE',
+    'cuda': 'DNN_BACKEND_CUDA'
+}
+TARGETS = {
+    'cpu': 'DNN_TARGET_CPU',
+    'opencl': 'DNN_TARGET_OPENCL',
+    'opencl_fp16': 'DNN_TARGET_OPENCL_FP16',
+    'cuda': 'DNN_TARGET_CUDA',
+    'cuda_fp16': 'DNN_TARGET_CUDA_FP16'
+}
+
+class NetRegistry:
+    """A process-wide cache of loaded Caffe networks so that each
+    (prototxt, caffemodel) pair is only parsed once.
+
+    A cv2 net can't run two forward passes at the same time, so nets live in a
+    pool per model. `checkout` hands out an idle net (loading a new one only if
+    every pooled net is busy) and returns it to the pool afterward. Each net
+    holds tens of megabytes, so a pool never grows past `max_size` nets (by
+    default one per CPU); past that, `checkout` waits for a net to come back.
+
+    `configure` sets cv2's thread count and the backend and target that nets
+    run on. The registry also keeps a running estimate of each model's forward
+    pass time per pixel, fed by `record`, which is what lets BorderBuilder pick
+    an inference size to fit a latency budget.
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._returned = threading.Condition(self._lock)
+        self._idle = {}
+        self._loaded = {}
+        self._generation = 0
+        self._layers = {}
+        self._registered = set()
+        self._backend = None
+        self._target = None
+        self._seconds_per_pixel = {}
+
+    def configure(self, threads=None, backend=None, target=None):
+        """Set how many threads cv2 uses (for everything, not just nets) and
+        the backend and target nets run on, by name (see BACKENDS and
+        TARGETS). Settings left as None are unchanged. Pooled nets are dropped
+        when the backend or target changes, so the next ones load with it.
+        """
+        if backend is not None and backend not in BACKENDS:
+            raise ValueError(f'backend must be one of {", ".join(BACKENDS)}')
+        if target is not None and target not in TARGETS:
+            raise ValueError(f'target must be one of {", ".join(TARGETS)}')
+
+        if threads is not None:
+            cv2.setNumThreads(threads)
+
+        changed = (backend or self._backend, target or self._target) != (self._backend, self._target)
+        with self._lock:
+            self._backend = backend or self._backend
+            self._target = target or self._target
+        if changed:
+            self.clear()
+            # a new backend or target runs at a different speed
+            with self._lock:
+                self._seconds_per_pixel = {}
+
+    def register_layer(self, name, layer_class):
+        """Add a custom layer to cv2's dnn module. This is deferred until the
+        first net is loaded so that importing a builder doesn't touch cv2.dnn.
+        """
+        with self._lock:
+            self._layers[name] = layer_class
+
+    def _register_layers(self):
+        # cv2 can only have a layer registered once per process
+        with self._lock:
+            for name, layer_class in self._layers.items():
+                if name not in self._registered:
+                    cv2.dnn_registerLayer(name, layer_class)
+                    self._registered.add(name)
+
+    def _load(self, key):
+        """Parse a new net. It has to have been counted against its pool 
+        already, and is uncounted again if it fails to load.
+        """
+        prototxt, caffemodel = key
+        try:
+            self._register_layers()
+            net = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+            if self._backend is not None:
+                net.setPreferableBackend(getattr(cv2.dnn, BACKENDS[self._backend]))
+            if self._target is not None:
+                net.setPreferableTarget(getattr(cv2.dnn, TARGETS[self._target]))
+        except Exception:
+            with self._lock:
+                self._loaded[key] = max(self._loaded.get(key, 0) - 1, 0)
+                self._returned.notify()
+            raise
+        return net
+
+    @contextmanager
+    def checkout(self, prototxt, caffemodel):
+        """Borrow a loaded net for the length of a `with` block, waiting for
+        one if the pool is full and every net is busy
+        """
+        key = (prototxt, caffemodel)
+        with self._lock:
+            while True:
+                idle = self._idle.setdefault(key, [])
+                if idle:
+                    net = idle.pop()
+                    break
+                if self._loaded.get(key, 0) < self.max_size:
+                    # count the net now so nobody else loads past max_size
+                    self._loaded[key] = self._loaded.get(key, 0) + 1
+                    net = None
+                    break
+                self._returned.wait()
+            generation = self._generation
+
+        if net is None:
+            net = self._load(key)
+
+        try:
+            yield net
+        finally:
+            with self._lock:
+                if generation == self._generation:
+                    self._idle.setdefault(key, []).append(net)
+                self._returned.notify()
+
+    def warm_up(self, prototxt, caffemodel, n=1):
+        """Load nets until at least `n` of them (but no more than `max_size`)
+        are pooled for the given model, so the load cost is paid up front 
+        rather than on the first request.
+        """
+        key = (prototxt, caffemodel)
+        with self._lock:
+            missing = min(n, self.max_size) - self._loaded.get(key, 0)
+            if missing > 0:
+                self._loaded[key] = self._loaded.get(key, 0) + missing
+
+        for _ in range(missing):
+            net = self._load(key)
+            with self._lock:
+                self._idle.setdefault(key, []).append(net)
+                self._returned.notify()
+
+    def loaded(self, prototxt, caffemodel):
+        """The number of nets loaded for the given model"""
+        with self._lock:
+            return self._loaded.get((prototxt, caffemodel), 0)
+
+    def record(self, prototxt, caffemodel, pixels, seconds):
+        """Fold a forward pass over `pixels` input pixels that took `seconds`
+        into the model's estimate of seconds per pixel
+        """
+        key = (prototxt, caffemodel)
+        with self._lock:
+            estimate = self._seconds_per_pixel.get(key)
+            observed = seconds / pixels
+            # a moving average, so the estimate follows changes in load
+            self._seconds_per_pixel[key] = observed if estimate is None else 0.7 * estimate + 0.3 * observed
+
+    def seconds_per_pixel(self, prototxt, caffemodel):
+        """The model's estimated forward pass time per pixel, or None if it
+        hasn't run yet
+        """
+        with self._lock:
+            return self._seconds_per_pixel.get((prototxt, caffemodel))
+
+    def clear(self):
+        """Drop every idle net. Nets that are checked out are dropped on return."""
+        with self._lock:
+            self._idle = {}
+            self._loaded = {}
+            self._generation += 1
+            self._returned.notify_all()
+
+
+# Shared by every BorderBuilder in the process
+net_registry = NetRegistry()
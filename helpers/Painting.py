@@ -1,73 +1,186 @@
-import pygame
+import copy
+
+from PIL import Image
+import numpy as np
 
 class Painting:
     """A class that combines the LineBuilder and ColorBuilder classes to create the
     final Mondrian painting
+
+    Every shape in a painting is an axis-aligned rectangle, so the painting is
+    rendered by filling slices of a NumPy canvas, and the same rectangles can be
+    exported as an SVG.
+
+    The layout is kept in coordinates from 0 to 1, so the painting can be
+    rendered at any `size` (width, height), not just the size the structure
+    was found at. `line_width` is in pixels at that analysis size and scales
+    with the painting.
     """
     def __init__(
-        self, 
-        line_builder, 
+        self,
+        line_builder,
         color_builder,
-        line_width=8
+        line_width=8,
+        size=None
     ):
         self.line_builder = line_builder
         self.color_builder = color_builder
-        self.height = line_builder.height
-        self.width = line_builder.width
+        self.width, self.height = size or (line_builder.width, line_builder.height)
         self.line_width = line_width
-        
-        self.black = pygame.Color(*color_builder.black)
-        self.white = pygame.Color(*color_builder.white)
-        self.primary_color = pygame.Color(*color_builder.primary_color)
+
+        self.black = tuple(color_builder.black)
+        self.white = tuple(color_builder.white)
+        self.primary_color = tuple(color_builder.primary_color)
 
         # To be set later
-        self.surface = None
+        self.layout = None
+        self.rectangles = None
+        self.canvas = None
+
+
+    def build_layout(self):
+        """Describe the lines and color box as fractions of the width and 
+        height, and the line width as a fraction of the shorter side
+        """
+        line_builder = self.line_builder
+        width, height = line_builder.width, line_builder.height
+
+        color_builder = self.color_builder
+        if color_builder.primary_color_box is None:
+            color_builder.get_color_box(line_builder.segments, line_builder.face_index)
+        x, y, w, h = color_builder.primary_color_box
+
+        def normalize(seg):
+            (x1, y1), (x2, y2) = seg
+            return ((x1 / width, y1 / height), (x2 / width, y2 / height))
 
+        self.layout = {
+            'segments': {axis: [normalize(seg) for seg in line_builder.segments[axis]] for axis in 'xy'},
+            'box': [x / width, y / height, w / width, h / height],
+            'line_width': self.line_width / min(width, height)
+        }
 
-    def setup_surface(self):
-        """Create our canvas"""
-        surface = pygame.Surface((self.width, self.height))
-        background_color = self.white
-        surface.fill(background_color)
-        self.surface = surface
+
+    def pixel_line_width(self):
+        """The line width in pixels at the painting's size"""
+        return max(1, round(self.layout['line_width'] * min(self.width, self.height)))
+
+
+    def to_pixels(self, point):
+        """Scale a normalized (x, y) point to the painting's size"""
+        x, y = point
+        return round(x * self.width), round(y * self.height)
+
+
+    def setup_canvas(self):
+        """Start the layout with a white background"""
+        self.rectangles = [(0, 0, self.width, self.height, self.white)]
+
+
+    def line_rectangle(self, seg, line_width):
+        """The rectangle [x, y, width, height] covered by a segment drawn with
+        the given width, centered on the segment
+        """
+        (x1, y1), (x2, y2) = seg
+        offset = line_width // 2
+        if x1 == x2:
+            top, bottom = sorted([y1, y2])
+            return [x1 - offset, top, line_width, bottom - top + 1]
+        left, right = sorted([x1, x2])
+        return [left, y1 - offset, right - left + 1, line_width]
 
 
     def draw_lines(self):
-        """Draw all the segments from a LineBuilder class"""
-        segments = self.line_builder.segments
-        for seg in segments['x'] + segments['y']:
-            pygame.draw.line(self.surface, self.black, seg[0], seg[1], self.line_width)
+        """Draw all the segments from the layout"""
+        segments = self.layout['segments']
+        line_width = self.pixel_line_width()
+        for p1, p2 in segments['x'] + segments['y']:
+            seg = (self.to_pixels(p1), self.to_pixels(p2))
+            self.rectangles.append((*self.line_rectangle(seg, line_width), self.black))
 
 
     def draw_box(self):
-        """Draw the primary color box from a ColorBuilder class"""
-        color_builder = self.color_builder
-        color_box = color_builder.get_color_box(self.line_builder.segments) if color_builder.primary_color_box is None else color_builder.primary_color_box
-        pygame.draw.rect(self.surface, color_builder.primary_color, color_builder.primary_color_box)
+        """Draw the primary color box from the layout"""
+        x, y, w, h = self.layout['box']
+        # scale the corners rather than the size so the box meets the lines
+        x1, y1 = self.to_pixels((x, y))
+        x2, y2 = self.to_pixels((x + w, y + h))
+        self.rectangles.append((x1, y1, x2 - x1, y2 - y1, self.primary_color))
 
 
     def draw_border(self):
-        """Draw a clean border around our canvas"""
-        # pygame has some weird border issues
-        # This needs to be fixed in the longterm, but hardcoding works for now
-        height_border = self.height - 2
-        width_border = self.width - 3
-        border_line_width = self.line_width + 2
+        """Draw a clean border of even width around our canvas"""
+        border = (self.pixel_line_width() + 2) // 2
+        width, height = self.width, self.height
 
-        pygame.draw.line(self.surface, self.black, [0, 0], [0, height_border], border_line_width)
-        pygame.draw.line(self.surface, self.black, [width_border, 0], [width_border, height_border], border_line_width)
-        pygame.draw.line(self.surface, self.black, [0, height_border], [width_border, height_border], border_line_width)
-        pygame.draw.line(self.surface, self.black, [0, 0], [width_border, 0], border_line_width)
+        self.rectangles.append((0, 0, border, height, self.black))
+        self.rectangles.append((width - border, 0, border, height, self.black))
+        self.rectangles.append((0, 0, width, border, self.black))
+        self.rectangles.append((0, height - border, width, border, self.black))
 
 
-    def create(self):
-        """Usher the painting through the pipeline"""
-        self.setup_surface()
+    def rasterize(self):
+        """Fill the layout's rectangles into an RGB array, in order"""
+        canvas = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        for x, y, w, h, color in self.rectangles:
+            x1, y1 = max(x, 0), max(y, 0)
+            x2, y2 = min(x + w, self.width), min(y + h, self.height)
+            if x1 < x2 and y1 < y2:
+                canvas[y1:y2, x1:x2] = color
+        self.canvas = canvas
+
+
+    def draw(self):
+        """Lay out the rectangles at the painting's size and fill them in"""
+        self.setup_canvas()
         self.draw_box()
         self.draw_lines()
         self.draw_border()
+        self.rasterize()
+
+
+    def create(self):
+        """Usher the painting through the pipeline"""
+        self.build_layout()
+        self.draw()
+
+
+    def render(self, size):
+        """Return a copy of the painting drawn at another (width, height)"""
+        painting = copy.copy(self)
+        painting.width, painting.height = size
+        painting.draw()
+        return painting
+
+
+    def to_array(self):
+        """Return the painting as an RGB NumPy array"""
+        return self.canvas
+
+
+    def to_svg(self):
+        """Return the painting as an SVG document"""
+        def hex_color(color):
+            return '#{:02x}{:02x}{:02x}'.format(*color)
+
+        elements = [
+            f'<rect x="{x}" y="{y}" width="{w}" height="{h}" fill="{hex_color(color)}"/>'
+            for x, y, w, h, color in self.rectangles
+        ]
+        return '\n'.join([
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+            f'viewBox="0 0 {self.width} {self.height}" shape-rendering="crispEdges">',
+            *elements,
+            '</svg>'
+        ]) + '\n'
 
 
     def save(self, filename):
-        """Save the surface to the given filename"""
-        pygame.image.save(self.surface, filename)
+        """Save the painting to the given filename"""
+        Image.fromarray(self.canvas).save(filename)
+
+
+    def save_svg(self, filename):
+        """Save the painting as an SVG to the given filename"""
+        with open(filename, 'w') as f:
+            f.write(self.to_svg())
@@ -0,0 +1,107 @@
+import os
+import json
+import zipfile
+import tempfile
+import hashlib
+
+import numpy as np
+
+class StageCache:
+    """A content-addressed on-disk cache for the output of pipeline stages.
+
+    Entries are keyed by a hash of the input pixels, the stage name and the
+    parameters that stage depends on, so a repeated request can skip the work.
+    The cache is kept under `max_bytes` by evicting the least recently used
+    entries; reading an entry marks it as used.
+
+    Values are NumPy arrays or JSON-compatible objects, stored as .npz files
+    that are read without pickle, so a cache file can't run code. Anyone who
+    can write to `cache_dir` can still change the results it serves, so a new
+    directory is only accessible to its owner.
+    """
+    def __init__(self, cache_dir='cache/', max_bytes=256 * 2 ** 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, mode=0o700)
+
+    @staticmethod
+    def hash_pixels(pixels):
+        """Hash an image array, including its shape and type"""
+        digest = hashlib.sha256()
+        digest.update(f'{pixels.shape}{pixels.dtype}'.encode())
+        digest.update(pixels.tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(stage, pixel_hash, **params):
+        """Build the cache key for a stage's output"""
+        description = json.dumps([stage, pixel_hash, params], sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss"""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                if 'array' in entry:
+                    value = entry['array']
+                else:
+                    value = json.loads(str(entry['json']))
+            os.utime(path)
+        except (FileNotFoundError, ValueError, KeyError, OSError, zipfile.BadZipFile):
+            return None
+        return value
+
+    def put(self, key, value):
+        """Store an array or a JSON-compatible value, then evict old entries if
+        the cache is too big. Caching is best effort: returns False, rather than
+        raising, if the entry couldn't be written (e.g. the disk is full).
+        """
+        # a temp file of its own, so threads storing the same key don't collide
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                if isinstance(value, np.ndarray):
+                    np.savez(f, array=value)
+                else:
+                    # NumPy scalars (e.g. segment coordinates) become plain numbers
+                    np.savez(f, json=np.array(json.dumps(value, default=lambda o: o.item())))
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return False
+
+        self.evict()
+        return True
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,41 @@
+"""Small helpers so the builders can take either a file path or an in-memory
+image. Arrays follow PIL's conventions: RGB (or single channel) uint8 with
+shape (height, width[, channels]).
+"""
+from PIL import Image
+import numpy as np
+
+
+def is_array(image_in):
+    """True if `image_in` is an in-memory image rather than a file path"""
+    return isinstance(image_in, np.ndarray)
+
+
+def open_image(image_in):
+    """Return a PIL Image from a file path or a NumPy array"""
+    if is_array(image_in):
+        return Image.fromarray(image_in)
+    return Image.open(image_in)
+
+
+def load_array(image_in):
+    """Return a NumPy array from a file path or a NumPy array"""
+    if is_array(image_in):
+        return image_in
+    return np.asarray(Image.open(image_in))
+
+
+def fit_size(width, height, SIZE):
+    """Proportionally scale (width, height) so that the larger side is SIZE"""
+    if width > height:
+        new_width = SIZE
+        new_height = int(new_width / width * height)
+    else:
+        new_height = SIZE
+        new_width = int(new_height / height * width)
+    return new_width, new_height
+
+
+def blend(background, foreground):
+    """Mix two RGB arrays of the same shape half and half"""
+    return ((background.astype(np.uint16) + foreground) // 2).astype(np.uint8)